@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import math
+import os
+import time
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.admission")
+
+# Analyzer types that get their own concurrency limit and wait queue
+ADMISSION_TYPES = ["code", "key", "paste", "copy", "tab"]
+
+# Longest time a request may wait in the queue before it is shed (seconds)
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 5))
+
+# Smoothing factor for the moving average of service time used in Retry-After
+SERVICE_TIME_EWMA_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed because its analyzer type is saturated."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Bounded concurrency with a bounded wait queue for one analyzer type.
+
+    Up to max_concurrent requests run at once and up to max_queue wait for a slot.
+    Requests beyond that, or that wait longer than queue_timeout, are rejected so
+    latency stays bounded for the requests that are admitted.
+    """
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.avg_service_seconds = 1.0
+
+    def retry_after(self):
+        """Estimated seconds until a slot frees up for a new request (at least 1)."""
+        backlog = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(backlog * self.avg_service_seconds))
+
+    async def acquire(self):
+        if not self._semaphore.locked():
+            # A slot is free: take it without yielding to the event loop
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise AdmissionRejected(f"Too many pending '{self.name}' analyses; retry later", self.retry_after())
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise AdmissionRejected(f"Timed out waiting for a '{self.name}' analysis slot; retry later", self.retry_after())
+            finally:
+                self.waiting -= 1
+
+        self.active += 1
+        self.admitted += 1
+
+    def release(self, service_seconds):
+        self.active -= 1
+        self.avg_service_seconds += SERVICE_TIME_EWMA_ALPHA * (service_seconds - self.avg_service_seconds)
+        self._semaphore.release()
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_service_seconds": round(self.avg_service_seconds, 3),
+        }
+
+
+class _Admission:
+    """Async context manager holding one admitted slot."""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.started_at = None
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.started_at = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release(time.monotonic() - self.started_at)
+        return False
+
+
+class AdmissionController:
+    """
+    Per-analyzer-type admission control.
+
+    Limits are read from ADMISSION_<TYPE>_CONCURRENCY and ADMISSION_<TYPE>_QUEUE
+    (e.g. ADMISSION_CODE_QUEUE), falling back to the given defaults.
+    """
+
+    def __init__(self, default_concurrency, default_queue):
+        self.limiters = {}
+        for name in ADMISSION_TYPES:
+            prefix = f"ADMISSION_{name.upper()}"
+            self.limiters[name] = AdmissionLimiter(
+                name,
+                int(os.getenv(f"{prefix}_CONCURRENCY", default_concurrency)),
+                int(os.getenv(f"{prefix}_QUEUE", default_queue)),
+            )
+
+    def admit(self, event_type):
+        """
+        Returns an async context manager that holds a slot for event_type.
+
+        Raises:
+            AdmissionRejected: On entry, if the request is shed.
+        """
+        return _Admission(self.limiters[event_type])
+
+    def queue_depth(self, event_type):
+        return self.limiters[event_type].waiting
+
+    def stats(self):
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
@@ -0,0 +1,318 @@
+import json
+import logging
+import os
+
+from checkcodetype import detect_language
+from py import CodeAnalyzer
+from cpp import detect_ai_cpp_code
+from java import detect_ai_generated_java
+from javascript import detect_ai_js
+from paste import analyze_paste_suspicion
+from copymain import analyze_copy_event
+from keymain import SuspiciousBehaviorDetector
+from tab import analyze_tab_switch
+from storage import KEYLOG_COUNT_FIELD, iter_key_log_chunks
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.analyzers")
+
+
+class AnalyzerError(Exception):
+    """Raised when an analyzer cannot produce a result for a document."""
+
+
+# Event types accepted by tab.py (mirrors the check in its __main__ block)
+TAB_EVENT_TYPES = ["tab_switch", "tab_deactivated", "tab_activated", "window_blurred", "window_focused", "url_change"]
+
+# Event type stored alongside each response; everything else is "code"
+EVENT_TYPES = {
+    "copymain.py": "copy",
+    "paste.py": "paste",
+    "keymain.py": "key",
+    "tab.py": "tab",
+}
+
+# Version of the analysis stored with each result, per event type. Bump an entry when a
+# change to its analyzers alters their output, so stored results of the previous version
+# are recomputed instead of reused.
+ANALYZER_VERSIONS = {
+    "code": 1,
+    "key": 1,
+    "paste": 1,
+    "copy": 1,
+    "tab": 1,
+}
+
+# Scripts whose documents contain source code and are routed through detect_language
+CODE_SCRIPTS = ["cpp.py", "py.py", "java.py", "javascript.py"]
+
+# Top-level activity document fields each analyzer reads (_id is always returned).
+# Documents are fetched with a projection of these fields, so large fields the analyzer
+# never reads are not transferred or decoded. An analyzer sees a field missing from its
+# list as absent, so extend the list whenever an analyzer starts reading a new field.
+CODE_FIELDS = ["code"]
+ANALYZER_FIELDS = {
+    "paste.py": ["data"],
+    "copymain.py": ["eventType", "data", "contentLength", "page", "problemTitle", "problemName", "username", "timestamp"],
+    "keymain.py": ["keyLogs"],
+    "tab.py": ["eventType", "fromUrl", "fromTitle", "toUrl", "toTitle", "problemId", "problemTitle", "platform", "username", "timestamp"],
+    **{script_name: CODE_FIELDS for script_name in CODE_SCRIPTS},
+}
+
+# Keystroke sessions with at least this many key logs are not fetched whole: the keystroke
+# analyzer reads them in KEYLOG_CHUNK_SIZE slices instead (0 disables streaming)
+KEYLOG_STREAM_THRESHOLD = int(os.getenv("KEYLOG_STREAM_THRESHOLD", 50000))
+
+# Fields route_document reads
+ROUTING_FIELDS = ["eventType", "keyLogs", "code"]
+
+# Activity eventType -> analyzer script, for routing documents nobody asked about explicitly
+EVENT_TYPE_SCRIPTS = {
+    "copy": "copymain.py",
+    "paste": "paste.py",
+    **{event_type: "tab.py" for event_type in TAB_EVENT_TYPES},
+}
+
+# Language name returned by checkcodetype.detect_language -> analyzer script
+LANGUAGE_SCRIPTS = {
+    "Java": "java.py",
+    "Python": "py.py",
+    "C++": "cpp.py",
+    "JavaScript": "javascript.py",
+}
+
+
+# Analysis profiles: "fast" skips or approximates the costliest factors under load
+PROFILE_FULL = "full"
+PROFILE_FAST = "fast"
+
+# Scripts that have a fast profile; every other script always runs in full
+FAST_PROFILE_SCRIPTS = ["py.py", "cpp.py", "javascript.py"]
+
+
+# --- Entry Points ---
+# Each entry point takes the activity document, a time budget in seconds (or None) and
+# a profile, and returns the raw analyzer output. Analyzers with several factor stages
+# check the budget between stages and return a partial result once it is spent; paste,
+# copy and tab are a single cheap pass and do not need to.
+
+def _analyze_python(document, time_budget=None, profile=PROFILE_FULL):
+    return CodeAnalyzer(document['code'], profile=profile).analyze(time_budget=time_budget)
+
+def _analyze_cpp(document, time_budget=None, profile=PROFILE_FULL):
+    return detect_ai_cpp_code(document['code'], time_budget=time_budget, profile=profile)
+
+def _analyze_java(document, time_budget=None, profile=PROFILE_FULL):
+    return detect_ai_generated_java(document['code'], time_budget=time_budget)
+
+def _analyze_javascript(document, time_budget=None, profile=PROFILE_FULL):
+    return detect_ai_js(document['code'], time_budget=time_budget, profile=profile)
+
+def _analyze_paste(document, time_budget=None, profile=PROFILE_FULL):
+    return analyze_paste_suspicion(document)
+
+def _analyze_copy(document, time_budget=None, profile=PROFILE_FULL):
+    return analyze_copy_event(document)
+
+def _analyze_key(document, time_budget=None, profile=PROFILE_FULL):
+    if "keyLogs" not in document and document.get(KEYLOG_COUNT_FIELD):
+        # Long sessions arrive without keyLogs and are read here one slice at a time
+        chunks = iter_key_log_chunks(document["_id"])
+        return SuspiciousBehaviorDetector().analyze_stream(chunks, document["_id"], time_budget=time_budget)
+    return SuspiciousBehaviorDetector().analyze(document, time_budget=time_budget)
+
+def _analyze_tab(document, time_budget=None, profile=PROFILE_FULL):
+    if document.get("eventType") not in TAB_EVENT_TYPES:
+        raise AnalyzerError(f"Document {document.get('_id')} is not a 'tab_switch' event (eventType: {document.get('eventType')})")
+    return analyze_tab_switch(document)
+
+
+ANALYZERS = {
+    "paste.py": _analyze_paste,
+    "copymain.py": _analyze_copy,
+    "keymain.py": _analyze_key,
+    "tab.py": _analyze_tab,
+    "cpp.py": _analyze_cpp,
+    "py.py": _analyze_python,
+    "java.py": _analyze_java,
+    "javascript.py": _analyze_javascript,
+}
+
+
+# --- Helper Functions ---
+
+def get_event_type(script_name):
+    """Returns the event type stored with responses produced by script_name."""
+    return EVENT_TYPES.get(script_name, "code")
+
+def get_analyzer_version(event_type):
+    """Returns the current analyzer version for an event type."""
+    return ANALYZER_VERSIONS.get(event_type, 1)
+
+def get_required_fields(script_names):
+    """
+    Returns the document fields a fetch must return for the given analyzer scripts.
+
+    Args:
+        script_names (iterable): Requested analyzer scripts.
+
+    Returns:
+        list or None: Sorted union of the fields the scripts read, or None (fetch the
+                      whole document) if any script does not declare its fields.
+    """
+    fields = set()
+    for script_name in script_names:
+        declared = ANALYZER_FIELDS.get(script_name)
+        if declared is None:
+            return None
+        fields.update(declared)
+    return sorted(fields)
+
+def get_ingest_fields():
+    """Returns the fields ingestion needs to route a document and run whichever analyzer it picks."""
+    return sorted(set(ROUTING_FIELDS).union(*ANALYZER_FIELDS.values()))
+
+def route_document(document):
+    """
+    Picks the analyzer script for an activity document from its contents.
+
+    Routes by eventType first (copy, paste, tab events), then by payload: documents
+    with keyLogs go to the keystroke analyzer and documents with code to a code
+    analyzer (resolve_script later picks the language).
+
+    Returns:
+        str or None: The script name, or None if no analyzer applies.
+    """
+    script_name = EVENT_TYPE_SCRIPTS.get(document.get("eventType"))
+    if script_name:
+        return script_name
+    if isinstance(document.get("keyLogs"), list) and document["keyLogs"]:
+        return "keymain.py"
+    if isinstance(document.get("code"), str) and document["code"].strip():
+        return "py.py"
+    return None
+
+def resolve_script(script_name, document):
+    """
+    Returns the analyzer script to run for a request.
+
+    Code scripts are routed by the language detected in document['code'];
+    other scripts are returned unchanged.
+
+    Raises:
+        AnalyzerError: If the detected language has no analyzer.
+    """
+    if script_name not in CODE_SCRIPTS:
+        return script_name
+
+    language = detect_language(document.get('code'))
+    logger.info(f"Detected language: {language}")
+
+    resolved = LANGUAGE_SCRIPTS.get(language)
+    if resolved is None:
+        logger.warning(f"Unsupported language detected: {language}")
+        raise AnalyzerError("could not find language among cpp,java,js,py")
+    return resolved
+
+def normalize_result(result):
+    """
+    Converts analyzer output into the JSON-compatible dict the scripts used to print.
+
+    Some analyzers return a JSON string (py.py, cpp.py, java.py), others a dict that
+    may contain ObjectId/datetime values, which were previously serialized with default=str.
+    """
+    if isinstance(result, str):
+        return json.loads(result)
+    return json.loads(json.dumps(result, default=str))
+
+def run_analyzer(script_name, document, time_budget=None, profile=PROFILE_FULL):
+    """
+    Runs the analyzer registered for script_name against an already-fetched document.
+
+    The caller fetches the activity document once and hands it over, so analyzers
+    never go back to MongoDB for it.
+
+    Args:
+        script_name (str): One of the keys of ANALYZERS.
+        document (dict): The activity document to analyze.
+        time_budget (float, optional): Seconds the analyzer may spend before it returns
+            the factors computed so far, flagged "partial" with "skipped_factors".
+        profile (str): PROFILE_FULL or PROFILE_FAST; scripts without a fast profile run in full.
+
+    Returns:
+        dict: The analyzer response, in the same shape the standalone script printed,
+              plus "profile" naming the profile that produced it.
+
+    Raises:
+        AnalyzerError: If no analyzer is registered or the analyzer produced no result.
+    """
+    analyzer = ANALYZERS.get(script_name)
+    if analyzer is None:
+        raise AnalyzerError(f"No analyzer registered for script: {script_name}")
+
+    if script_name not in FAST_PROFILE_SCRIPTS:
+        profile = PROFILE_FULL
+
+    logger.info(f"Running analyzer {script_name} ({profile} profile) for document: {document.get('_id')}")
+    result = analyzer(document, time_budget=time_budget, profile=profile)
+    if result is None:
+        raise AnalyzerError("Analysis could not be performed on the document.")
+
+    response = normalize_result(result)
+    response["profile"] = profile
+    return response
+
+def run_analyzer_batch(script_name, documents, time_budget=None, profile=PROFILE_FULL):
+    """
+    Analyzes several documents requested with the same script in a single worker job.
+
+    Args:
+        script_name (str): The requested script (code scripts are routed per document).
+        documents (list): Activity documents to analyze.
+        time_budget (float, optional): Per-document time budget in seconds.
+        profile (str): Analysis profile for every document in the job.
+
+    Returns:
+        list: (ok, result_or_error_message) tuples, in the order of documents.
+    """
+    results = []
+    for document in documents:
+        try:
+            resolved = resolve_script(script_name, document)
+            results.append((True, run_analyzer(resolved, document, time_budget, profile)))
+        except Exception as e:
+            logger.error(f"Batch analysis failed for document {document.get('_id')}: {e}")
+            results.append((False, str(e)))
+    return results
+
+
+class ProfileSelector:
+    """
+    Picks the analysis profile from the current analyzer queue depth.
+
+    Switches to the fast profile once the queue reaches `threshold` jobs and back to
+    the full profile only after it drains below half of that, so the profile does not
+    flap around the threshold.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = max(1, threshold)
+        self.profile = PROFILE_FULL
+        self.counts = {PROFILE_FULL: 0, PROFILE_FAST: 0}
+
+    def select(self, queue_depth):
+        if self.profile == PROFILE_FULL and queue_depth >= self.threshold:
+            logger.warning(f"Analyzer queue depth {queue_depth} reached {self.threshold}; switching to fast profile")
+            self.profile = PROFILE_FAST
+        elif self.profile == PROFILE_FAST and queue_depth < self.threshold / 2:
+            logger.info(f"Analyzer queue depth {queue_depth} drained; switching back to full profile")
+            self.profile = PROFILE_FULL
+        self.counts[self.profile] += 1
+        return self.profile
+
+    def stats(self):
+        return {
+            "current": self.profile,
+            "threshold": self.threshold,
+            "selected": dict(self.counts),
+        }
@@ -0,0 +1,111 @@
+"""
+Compares JSON and MessagePack payload size and encode/decode time for API responses.
+
+Uses the analyzer output shapes in schema/mock_data, both as single /execute responses
+and wrapped in an /execute/batch response, encoded the way the API encodes them.
+
+Usage:
+    python benchmark_codec.py [--batch-items 1000] [--repeat 200]
+"""
+import argparse
+import glob
+import json
+import os
+import timeit
+
+from codec import MSGPACK_AVAILABLE
+
+if MSGPACK_AVAILABLE:
+    import msgpack
+    from codec import pack
+
+MOCK_DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema", "mock_data")
+
+
+def encode_json(content):
+    # Same settings as fastapi.responses.JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def load_shapes():
+    """Returns {name: payload} for every analyzer output in schema/mock_data."""
+    shapes = {}
+    for path in sorted(glob.glob(os.path.join(MOCK_DATA_DIRECTORY, "*.json"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if name == "low_suspicion_examples":
+            # One file holding several outputs
+            shapes.update(data)
+        else:
+            shapes[name] = data
+    return shapes
+
+def build_batch_response(shapes, items):
+    """Builds an /execute/batch response with `items` results cycling through the shapes."""
+    payloads = list(shapes.values())
+    return {
+        "results": [
+            {
+                "index": index,
+                "script_name": "py.py",
+                "object_id": f"{index:024x}",
+                "status": "success",
+                "response": payloads[index % len(payloads)],
+            }
+            for index in range(items)
+        ],
+        "stats": {"items": items, "succeeded": items, "failed": 0, "stored": items, "elapsed_seconds": 1.0},
+    }
+
+def measure(content, repeat):
+    """Returns size in bytes and per-call encode/decode time in microseconds for each format."""
+    number = max(1, repeat)
+    encoded_json = encode_json(content)
+    row = {
+        "json_bytes": len(encoded_json),
+        "json_encode_us": timeit.timeit(lambda: encode_json(content), number=number) / number * 1e6,
+        "json_decode_us": timeit.timeit(lambda: json.loads(encoded_json), number=number) / number * 1e6,
+    }
+    if MSGPACK_AVAILABLE:
+        encoded_msgpack = pack(content)
+        assert msgpack.unpackb(encoded_msgpack, raw=False) == json.loads(encoded_json)
+        row.update(
+            msgpack_bytes=len(encoded_msgpack),
+            msgpack_encode_us=timeit.timeit(lambda: pack(content), number=number) / number * 1e6,
+            msgpack_decode_us=timeit.timeit(lambda: msgpack.unpackb(encoded_msgpack, raw=False), number=number) / number * 1e6,
+        )
+    return row
+
+def print_table(rows):
+    header = f"{'payload':<28} {'json B':>9} {'mp B':>9} {'size':>6} {'json enc':>9} {'mp enc':>9} {'json dec':>9} {'mp dec':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, row in rows:
+        if "msgpack_bytes" in row:
+            print(f"{name:<28} {row['json_bytes']:>9} {row['msgpack_bytes']:>9} {row['msgpack_bytes'] / row['json_bytes']:>6.0%} "
+                  f"{row['json_encode_us']:>9.1f} {row['msgpack_encode_us']:>9.1f} "
+                  f"{row['json_decode_us']:>9.1f} {row['msgpack_decode_us']:>9.1f}")
+        else:
+            print(f"{name:<28} {row['json_bytes']:>9} {'-':>9} {'-':>6} {row['json_encode_us']:>9.1f} {'-':>9} "
+                  f"{row['json_decode_us']:>9.1f} {'-':>9}")
+    print("\nSizes in bytes, times in microseconds per call.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSON and MessagePack on the schema/mock_data shapes.")
+    parser.add_argument("--batch-items", type=int, default=1000, help="Results in the simulated batch response")
+    parser.add_argument("--repeat", type=int, default=200, help="Timing iterations per measurement")
+    args = parser.parse_args()
+
+    if not MSGPACK_AVAILABLE:
+        print("msgpack is not installed; only JSON is measured (pip install msgpack).")
+
+    shapes = load_shapes()
+    rows = [(name, measure(content, args.repeat)) for name, content in shapes.items()]
+    batch = build_batch_response(shapes, args.batch_items)
+    rows.append((f"batch ({args.batch_items} items)", measure(batch, max(1, args.repeat // 20))))
+    print_table(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compares peak memory of whole-document and streamed keystroke analysis.
+
+Builds a synthetic keystroke session and analyzes it the two ways the API can:
+- whole: the document arrives as one BSON reply, is decoded into Python dicts and
+  passed to SuspiciousBehaviorDetector.analyze (which also sorts the array);
+- stream: the keyLogs array arrives as KEYLOG_CHUNK_SIZE slices, as returned by
+  storage.iter_key_log_chunks, and each slice is fed to analyze_stream and dropped.
+
+Two sessions can be generated: "typing" (steady typing with an occasional pause) and
+"bursts" (back-to-back Ctrl+V pairs 20 ms apart, so every key is a paste or ends a paste
+burst), which checks that the reported paste timestamps stay bounded in both modes.
+
+Each mode runs in a fresh interpreter so their peak RSS does not mix. The BSON replies
+are generated on the fly instead of read from MongoDB (a real document is capped at
+16 MB, about 370k key logs), so the numbers cover decoding and analysis, not the network.
+
+Usage:
+    python benchmark_keylogs.py [--keys 1000000] [--chunk-size 10000] [--session typing|bursts]
+"""
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import sys
+import time
+
+import bson
+
+from keymain import SuspiciousBehaviorDetector
+from storage import KEYLOG_CHUNK_SIZE
+
+KEYS = ["a", "s", "d", "f", " ", "Enter", "Backspace", "Control", "v", "e"]
+
+
+def typing_key_log(index):
+    """Deterministic synthetic key log: steady typing in time order, with a long pause every 5000 keys."""
+    timestamp = 1_700_000_000_000 + index * 140 + (index * 37) % 90 + (index // 5000) * 20000
+    return {"key": KEYS[(index * 7) % len(KEYS)], "timestamp": float(timestamp)}
+
+def burst_key_log(index):
+    """Deterministic synthetic key log: Control, v, Control, v, ... 20 ms apart."""
+    return {"key": "Control" if index % 2 == 0 else "v", "timestamp": float(1_700_000_000_000 + index * 20)}
+
+SESSIONS = {"typing": typing_key_log, "bursts": burst_key_log}
+
+
+def encode_array(name, start, stop, key_log):
+    """BSON document {name: [key_log(start), ..., key_log(stop - 1)]}, built without holding the dicts."""
+    elements = bytearray()
+    for position, index in enumerate(range(start, stop)):
+        elements += b"\x03" + str(position).encode() + b"\x00" + bson.encode(key_log(index))
+    array = (len(elements) + 5).to_bytes(4, "little") + elements + b"\x00"
+    body = b"\x04" + name.encode() + b"\x00" + array
+    return (len(body) + 5).to_bytes(4, "little") + body + b"\x00"
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_whole(keys, chunk_size, key_log):
+    reply = encode_array("keyLogs", 0, keys, key_log)
+    document = bson.decode(reply)
+    return SuspiciousBehaviorDetector().analyze(document)
+
+def run_stream(keys, chunk_size, key_log):
+    def chunks():
+        for start in range(0, keys, chunk_size):
+            yield bson.decode(encode_array("chunk", start, min(start + chunk_size, keys), key_log))["chunk"]
+    return SuspiciousBehaviorDetector().analyze_stream(chunks())
+
+MODES = {"whole": run_whole, "stream": run_stream}
+
+
+def measure(mode, keys, chunk_size, session):
+    """Runs one mode in this process and returns its peak RSS and result summary."""
+    logging.disable(logging.WARNING)
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    result = MODES[mode](keys, chunk_size, SESSIONS[session])
+    details = result["details"]
+    return {
+        "mode": mode,
+        "baseline_mb": round(baseline, 1),
+        "peak_mb": round(peak_rss_mb(), 1),
+        "seconds": round(time.perf_counter() - started, 2),
+        "suspicious_percentage": result["suspicious_percentage"],
+        "total_key_presses": details["total_key_presses"],
+        "pastes": details["rapid_paste_ctrl_v_count"] + details["paste_burst_count"],
+        "reported_timestamps": len(details["rapid_paste_ctrl_v_timestamps"]) + len(details["paste_burst_timestamps"]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare peak RSS of whole and streamed keystroke analysis.")
+    parser.add_argument("--keys", type=int, default=1_000_000, help="Key logs in the synthetic session")
+    parser.add_argument("--chunk-size", type=int, default=KEYLOG_CHUNK_SIZE, help="Key logs per streamed slice")
+    parser.add_argument("--session", choices=sorted(SESSIONS), default="typing", help="Synthetic session to generate")
+    parser.add_argument("--mode", choices=sorted(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.mode, args.keys, args.chunk_size, args.session)))
+        return
+
+    print(f"Synthetic {args.session} session: {args.keys} key logs, chunk size {args.chunk_size}\n")
+    print(f"{'mode':<8} {'baseline MB':>12} {'peak MB':>9} {'added MB':>9} {'seconds':>8} {'score':>7} {'pastes':>8} {'reported':>9}")
+    for mode in ("whole", "stream"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--keys", str(args.keys), "--chunk-size", str(args.chunk_size),
+             "--session", args.session],
+            capture_output=True, text=True, check=True).stdout
+        row = json.loads(output.strip().splitlines()[-1])
+        print(f"{row['mode']:<8} {row['baseline_mb']:>12.1f} {row['peak_mb']:>9.1f} {row['peak_mb'] - row['baseline_mb']:>9.1f} "
+              f"{row['seconds']:>8.2f} {row['suspicious_percentage']:>7} {row['pastes']:>8} {row['reported_timestamps']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import json
+import logging
+
+from fastapi.responses import JSONResponse, Response
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.codec")
+
+# Attempt to import optional dependencies
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    logger.warning("'msgpack' library not found. MessagePack requests and responses are disabled.")
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Names MessagePack goes by in Content-Type and Accept headers
+MSGPACK_MEDIA_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+
+
+class UnsupportedMediaType(Exception):
+    """Raised when a request body uses a media type this server cannot decode."""
+
+
+def media_type(header):
+    """Returns the bare, lower-cased media type of a Content-Type header value."""
+    return (header or "").split(";")[0].strip().lower()
+
+def is_msgpack(content_type):
+    return media_type(content_type) in MSGPACK_MEDIA_TYPES
+
+def accepts_msgpack(accept):
+    """
+    Returns True if an Accept header prefers MessagePack over JSON.
+
+    MessagePack must be listed explicitly; wildcards and missing headers get JSON.
+    """
+    if not MSGPACK_AVAILABLE or not accept:
+        return False
+    msgpack_q = json_q = 0.0
+    for entry in accept.split(","):
+        name, *params = entry.split(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name in MSGPACK_MEDIA_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif name in (JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE):
+            json_q = max(json_q, q)
+    return msgpack_q > 0 and msgpack_q >= json_q
+
+def decode_body(body, content_type):
+    """
+    Decodes a request body according to its Content-Type (JSON unless it names MessagePack).
+
+    Raises:
+        UnsupportedMediaType: If the body is MessagePack and msgpack is not installed.
+        ValueError: If the body cannot be decoded.
+    """
+    if is_msgpack(content_type):
+        if not MSGPACK_AVAILABLE:
+            raise UnsupportedMediaType("MessagePack is not supported by this server")
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack body: {str(e) or type(e).__name__}")
+    return json.loads(body)
+
+def pack(content):
+    """Encodes content as MessagePack; ObjectId, datetime and other values are sent as strings, as in JSON responses."""
+    return msgpack.packb(content, default=str, use_bin_type=True)
+
+def stream_unpacker():
+    """Returns an incremental decoder for a stream of concatenated MessagePack objects."""
+    return msgpack.Unpacker(raw=False)
+
+def encode_response(content, accept, status_code=200, headers=None):
+    """
+    Builds the response for `content` in the format the client asked for.
+
+    Args:
+        content: JSON-compatible response content.
+        accept (str): The request's Accept header.
+        status_code (int): HTTP status code.
+        headers (dict, optional): Extra response headers.
+
+    Returns:
+        Response: MessagePack if the Accept header prefers it, JSON otherwise.
+    """
+    if accepts_msgpack(accept):
+        return Response(content=pack(content), status_code=status_code, headers=headers, media_type=MSGPACK_MEDIA_TYPE)
+    return JSONResponse(content=content, status_code=status_code, headers=headers)
@@ -0,0 +1,176 @@
+"""
+Runs explain on every query shape the service issues and flags collection scans.
+
+Each shape mirrors a query in storage.py, ingest.py or workqueue.py (aggregations are
+built with the same pipeline builders). The winning plan of each is checked for a
+COLLSCAN stage; the few shapes that scan by design are listed as expected and reported
+without failing. Explain uses the "queryPlanner" verbosity, so nothing is executed or
+written. Add a shape here whenever the service gains a new query.
+
+Usage:
+    python explain_queries.py [--ensure-indexes]
+
+Exits with status 1 if any shape not expected to scan uses a collection scan.
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from jobs import JOB_MAX_ATTEMPTS
+from rollup import build_session_facets, build_session_projections
+from storage import (
+    ACTIVITIES_COLLECTION,
+    AIRESPONSE_COLLECTION,
+    INGEST_STATE_COLLECTION,
+    JOBS_COLLECTION,
+    WORKQUEUE_COLLECTION,
+    WORKQUEUE_NODES_COLLECTION,
+    ensure_indexes,
+    get_database,
+    key_log_chunk_pipeline,
+    key_log_document_pipeline,
+    latest_responses_pipeline,
+    projected_documents_pipeline,
+    session_events_pipeline,
+)
+from workqueue import ITEM_LEASED, ITEM_QUEUED, WORKQUEUE_MAX_ATTEMPTS
+
+# Placeholder values; the plan depends on the query shape, not on the values
+SAMPLE_ID = ObjectId()
+SAMPLE_IDS = [ObjectId() for _ in range(3)]
+NOW = datetime.utcnow()
+
+
+def find(collection, query, sort=None, limit=0, projection=None):
+    return {"collection": collection, "filter": query, "sort": sort, "limit": limit, "projection": projection}
+
+def aggregate(collection, pipeline):
+    return {"collection": collection, "pipeline": pipeline}
+
+# name -> query shape; writes are explained as the find that selects their documents
+QUERY_SHAPES = {
+    "fetch_document_by_id": find(ACTIVITIES_COLLECTION, {"_id": SAMPLE_ID}),
+    "fetch_documents_by_ids": find(ACTIVITIES_COLLECTION, {"_id": {"$in": SAMPLE_IDS}}),
+    "fetch_key_log_document": aggregate(ACTIVITIES_COLLECTION, key_log_document_pipeline(SAMPLE_ID, ["keyLogs"], 50000)),
+    "iter_key_log_chunks": aggregate(ACTIVITIES_COLLECTION, key_log_chunk_pipeline(SAMPLE_ID, 0, 10000)),
+    "fetch_session_events": aggregate(ACTIVITIES_COLLECTION, session_events_pipeline("username", "problemId", build_session_facets())),
+    "fetch_projected_documents": aggregate(ACTIVITIES_COLLECTION, projected_documents_pipeline(SAMPLE_IDS, build_session_projections()["key"])),
+    "ingest newest document": find(ACTIVITIES_COLLECTION, {}, sort=[("_id", -1)], limit=1),
+    "ingest poll": find(ACTIVITIES_COLLECTION, {"_id": {"$gt": SAMPLE_ID, "$lt": ObjectId()}}, sort=[("_id", 1)], limit=50),
+    "ingest analyzed ids": find(AIRESPONSE_COLLECTION, {"documentId": {"$in": SAMPLE_IDS}}, projection={"documentId": 1}),
+    "ingest checkpoint": find(INGEST_STATE_COLLECTION, {"_id": "activities"}),
+    "store_ai_responses upsert": find(AIRESPONSE_COLLECTION, {"documentId": SAMPLE_ID, "eventType": "code", "analyzerVersion": 1}),
+    "store_ai_responses error update": find(AIRESPONSE_COLLECTION, {"documentId": SAMPLE_ID, "eventType": "code", "analyzerVersion": 1, "status": {"$ne": "success"}}),
+    "fetch_current_response": find(AIRESPONSE_COLLECTION, {"documentId": SAMPLE_ID, "eventType": "code", "analyzerVersion": 1, "status": "success"}),
+    "fetch_latest_response": find(AIRESPONSE_COLLECTION, {"documentId": SAMPLE_ID}, sort=[("createdAt", -1)], limit=1),
+    "fetch_latest_response by type": find(AIRESPONSE_COLLECTION, {"documentId": SAMPLE_ID, "eventType": "code"}, sort=[("createdAt", -1)], limit=1),
+    "fetch_latest_responses": aggregate(AIRESPONSE_COLLECTION, latest_responses_pipeline(SAMPLE_IDS)),
+    "fetch_latest_responses by type": aggregate(AIRESPONSE_COLLECTION, latest_responses_pipeline(SAMPLE_IDS, "code")),
+    "job get": find(JOBS_COLLECTION, {"_id": SAMPLE_ID}),
+    "job claim": find(JOBS_COLLECTION, {
+        "$or": [{"status": ITEM_QUEUED}, {"status": ITEM_LEASED, "leaseExpiresAt": {"$lt": NOW}}],
+        "attempts": {"$lt": JOB_MAX_ATTEMPTS},
+    }, sort=[("createdAt", 1)], limit=1),
+    "job heartbeat / complete": find(JOBS_COLLECTION, {"_id": SAMPLE_ID, "status": ITEM_LEASED, "leaseOwner": "owner"}),
+    "job reclaim_expired": find(JOBS_COLLECTION, {"status": ITEM_LEASED, "leaseExpiresAt": {"$lt": NOW}}),
+    "workqueue claim": find(WORKQUEUE_COLLECTION, {
+        "$or": [{"status": ITEM_QUEUED}, {"status": ITEM_LEASED, "leaseExpiresAt": {"$lt": NOW}}],
+        "attempts": {"$lt": WORKQUEUE_MAX_ATTEMPTS},
+    }, sort=[("createdAt", 1)], limit=1),
+    "workqueue heartbeat / complete": find(WORKQUEUE_COLLECTION, {"_id": SAMPLE_ID, "status": ITEM_LEASED, "leaseOwner": "node"}),
+    "workqueue reclaim_expired": find(WORKQUEUE_COLLECTION, {"status": ITEM_LEASED, "leaseExpiresAt": {"$lt": NOW}}),
+    "workqueue stats": aggregate(WORKQUEUE_COLLECTION, [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]),
+    "workqueue node stats": find(WORKQUEUE_NODES_COLLECTION, {}),
+}
+
+# Shapes that read the whole collection by design
+EXPECTED_SCANS = {
+    "workqueue stats": "counts every item by status",
+    "workqueue node stats": "one small document per API instance",
+}
+
+
+def explain(shape):
+    """Returns the queryPlanner explain output of a query shape."""
+    if "pipeline" in shape:
+        return get_database().command("aggregate", shape["collection"], pipeline=shape["pipeline"], explain=True)
+    command = {"find": shape["collection"], "filter": shape["filter"]}
+    if shape["sort"]:
+        command["sort"] = dict(shape["sort"])
+    if shape["limit"]:
+        command["limit"] = shape["limit"]
+    if shape["projection"]:
+        command["projection"] = shape["projection"]
+    return get_database().command("explain", command, verbosity="queryPlanner")
+
+def winning_stages(explain_output):
+    """
+    Returns the stages of every winning plan in an explain output.
+
+    Aggregations nest their plan under $cursor, and sharded clusters report one plan
+    per shard, so the whole output is searched; rejected plans are ignored.
+
+    Returns:
+        list: (stage name, index name or None) tuples.
+    """
+    stages = []
+
+    def walk(node, in_winning_plan):
+        if isinstance(node, dict):
+            if in_winning_plan and isinstance(node.get("stage"), str):
+                stages.append((node["stage"], node.get("indexName")))
+            for key, value in node.items():
+                if key != "rejectedPlans":
+                    walk(value, in_winning_plan or key == "winningPlan")
+        elif isinstance(node, list):
+            for item in node:
+                walk(item, in_winning_plan)
+
+    walk(explain_output, False)
+    return stages
+
+def check(name, shape):
+    """Explains one shape; returns (status, plan summary)."""
+    stages = winning_stages(explain(shape))
+    if not stages:
+        return "NO PLAN", "-"
+    summary = " > ".join(f"{stage}({index})" if index else stage for stage, index in stages)
+    if any(stage == "COLLSCAN" for stage, _ in stages):
+        return ("EXPECTED" if name in EXPECTED_SCANS else "COLLSCAN"), summary
+    if all(stage == "EOF" for stage, _ in stages):
+        # Empty or missing collection: the planner had nothing to choose from
+        return "NO DATA", summary
+    return "OK", summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain every query shape the service issues and flag collection scans.")
+    parser.add_argument("--ensure-indexes", action="store_true", help="Create the declared indexes first")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.ensure_indexes:
+        report = ensure_indexes()
+        print(f"Indexes: {len(report['created'])} created, {len(report['existing'])} existing, {len(report['failed'])} failed\n")
+
+    failures = 0
+    for name, shape in QUERY_SHAPES.items():
+        try:
+            status, summary = check(name, shape)
+        except Exception as e:
+            status, summary = "ERROR", str(e)
+        if status in ("COLLSCAN", "ERROR"):
+            failures += 1
+        if status == "EXPECTED":
+            summary += f"  [{EXPECTED_SCANS[name]}]"
+        print(f"{status:<9} {shape['collection'] + ':':<16} {name:<32} {summary}")
+
+    print(f"\n{len(QUERY_SHAPES)} query shapes, {failures} with an unexpected collection scan or error")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from analyzers import route_document
+from storage import field_projection
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.ingest")
+
+# --- Configuration ---
+# Set to 1 to analyze new activity documents as they are inserted
+INGEST_ENABLED = os.getenv("INGEST_ENABLED", "0") == "1"
+# "auto" (change stream, polling if unsupported), "changestream" or "poll"
+INGEST_MODE = os.getenv("INGEST_MODE", "auto")
+# Events analyzed concurrently before the checkpoint is saved
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 50))
+# Idle wait between polls, and longest wait for more change events before a batch is processed (seconds)
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 1))
+# Polling only reads documents whose _id is at least this old (seconds), so documents
+# whose ObjectIds arrive out of order within this window are not skipped
+INGEST_POLL_LAG = float(os.getenv("INGEST_POLL_LAG", 5))
+
+MODE_AUTO = "auto"
+MODE_CHANGE_STREAM = "changestream"
+MODE_POLL = "poll"
+
+# MongoDB error codes of a change stream that cannot resume from its token: the token's
+# oplog entry is gone (ChangeStreamHistoryLost), or older servers' ChangeStreamFatalError
+CHANGE_STREAM_HISTORY_LOST_ERRORS = (286, 280)
+
+
+class ChangeStreamUnavailable(Exception):
+    """Raised when the deployment (or stand-in) cannot open a change stream."""
+
+
+def is_history_lost(error):
+    return isinstance(error, OperationFailure) and error.code in CHANGE_STREAM_HISTORY_LOST_ERRORS
+
+
+class IngestWorker:
+    """
+    Analyzes activity documents as they are inserted, so clients no longer need a
+    second /execute call per event.
+
+    New documents come from a change stream on inserts, or, where change streams are
+    unavailable (standalone mongod, in-memory stand-ins), from polling by ascending
+    _id. Events are handled in batches; after each batch the change stream resume
+    token and the last document _id are saved in the state collection, so a restart
+    resumes exactly after the last finished batch. Documents that already have an
+    airesponse are skipped, so events of a batch interrupted by a crash are not
+    analyzed twice.
+
+    If the resume token has fallen out of the oplog, a new stream is opened and the
+    documents inserted since the last saved _id are read by polling to catch up.
+
+    Polling relies on _id order, and ObjectIds are generated by the writers, so it only
+    reads documents whose _id is at least poll_lag seconds old. A document whose _id is
+    older than that when it becomes visible (a writer's clock running behind, or a slow
+    insert) can still be skipped; change streams have no such limit.
+
+    The collections are passed in, so the worker runs the same against a real
+    mongod or an in-memory stand-in with the pymongo collection API.
+    """
+
+    def __init__(self, analyze, run_blocking, collection, state_collection, responses_collection,
+                 name="activities", mode=INGEST_MODE, batch_size=INGEST_BATCH_SIZE,
+                 poll_interval=INGEST_POLL_INTERVAL, flush=None, fields=None, poll_lag=INGEST_POLL_LAG):
+        """
+        Args:
+            analyze (callable): Coroutine function (script_name, document) -> (ok, payload)
+                that analyzes and stores one document.
+            run_blocking (callable): Coroutine function that runs a blocking call off the event loop.
+            collection: The activities collection to watch.
+            state_collection: Collection holding the checkpoint document.
+            responses_collection: The airesponse collection, used to skip analyzed documents.
+            name (str): _id of the checkpoint document.
+            mode (str): MODE_AUTO, MODE_CHANGE_STREAM or MODE_POLL.
+            batch_size (int): Events per checkpoint.
+            poll_interval (float): Idle wait in seconds.
+            flush (callable, optional): Coroutine function awaited after each batch, before its
+                checkpoint is saved, that makes buffered airesponse writes durable.
+            fields (list, optional): Document fields to read (see analyzers.get_ingest_fields);
+                whole documents when omitted.
+            poll_lag (float): Age in seconds a document's _id must reach before polling reads it.
+        """
+        self.analyze = analyze
+        self.run_blocking = run_blocking
+        self.collection = collection
+        self.state_collection = state_collection
+        self.responses_collection = responses_collection
+        self.name = name
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.poll_interval = poll_interval
+        self.flush = flush
+        self.fields = fields
+        self.poll_lag = poll_lag
+        self._task = None
+
+        self.active_mode = None
+        self.processed = 0
+        self.failed = 0
+        self.skipped_unrouted = 0
+        self.skipped_duplicate = 0
+        self.checkpoints = 0
+        self.history_lost = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Started ingestion worker ({self.mode} mode)")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        return {
+            "mode": self.active_mode,
+            "processed": self.processed,
+            "failed": self.failed,
+            "skipped_unrouted": self.skipped_unrouted,
+            "skipped_duplicate": self.skipped_duplicate,
+            "checkpoints": self.checkpoints,
+            "history_lost": self.history_lost,
+        }
+
+    # --- Checkpoint ---
+
+    def load_state(self):
+        return self.state_collection.find_one({"_id": self.name}) or {}
+
+    def save_state(self, **fields):
+        self.state_collection.update_one(
+            {"_id": self.name},
+            {"$set": {**fields, "updatedAt": datetime.utcnow()}},
+            upsert=True,
+        )
+        self.checkpoints += 1
+
+    # --- Main Loop ---
+
+    async def _run(self):
+        while True:
+            try:
+                state = await self.run_blocking(self.load_state)
+                if self.mode == MODE_POLL:
+                    await self._poll(state)
+                    continue
+                try:
+                    await self._watch(state)
+                except ChangeStreamUnavailable as e:
+                    if self.mode != MODE_AUTO:
+                        raise
+                    logger.warning(f"Change streams unavailable ({str(e)}); falling back to polling")
+                    self.mode = MODE_POLL
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion worker error: {str(e)}", exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _open_stream(self, resume_token):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        if self.fields is not None:
+            # Trim inserted documents server-side; the change event's _id is the resume token and is kept
+            pipeline.append({"$project": {"fullDocument._id": 1, **{f"fullDocument.{field}": 1 for field in self.fields}}})
+        try:
+            return await self.run_blocking(
+                self.collection.watch,
+                pipeline,
+                resume_after=resume_token,
+                max_await_time_ms=int(self.poll_interval * 1000),
+            )
+        except OperationFailure as e:
+            if is_history_lost(e):
+                raise
+            # Standalone servers reject $changeStream
+            raise ChangeStreamUnavailable(str(e))
+        except (NotImplementedError, TypeError, AttributeError) as e:
+            # Stand-ins may not implement watch() at all
+            raise ChangeStreamUnavailable(str(e))
+
+    async def _watch(self, state):
+        self.active_mode = MODE_CHANGE_STREAM
+        saved_token = state.get("resumeToken")
+        last_id = state.get("lastId")
+        try:
+            stream = await self._open_stream(saved_token)
+        except OperationFailure as e:
+            # Only history loss gets through _open_stream as OperationFailure: the token is gone from the oplog: retrying it would fail forever. Start a new
+            # stream first, so nothing inserted from now on is missed, then catch up by
+            # polling; documents seen by both are skipped as already analyzed.
+            self.history_lost += 1
+            logger.error(f"Change stream cannot resume ({str(e)}); catching up by polling from {last_id}")
+            stream = await self._open_stream(None)
+            saved_token = None
+            try:
+                last_id = await self._catch_up(last_id)
+            except BaseException:
+                await self.run_blocking(stream.close)
+                raise
+        try:
+            batch = []
+            loop = asyncio.get_running_loop()
+            while True:
+                change = await self.run_blocking(stream.try_next)
+                if change is not None:
+                    if not batch:
+                        batch_started = loop.time()
+                    batch.append(change["fullDocument"])
+                    if len(batch) < self.batch_size and loop.time() - batch_started < self.poll_interval:
+                        continue
+                # The batch is full or old enough, or the stream has gone quiet
+                if batch:
+                    await self._process(batch)
+                    last_id = batch[-1]["_id"]
+                    batch = []
+                # The resume token points after the last change returned, all of which are processed
+                # (when idle it still advances past events filtered out by $match). The last _id is
+                # where a catch-up starts if the token is ever lost.
+                if stream.resume_token is not None and stream.resume_token != saved_token:
+                    await self.run_blocking(self.save_state, resumeToken=stream.resume_token, lastId=last_id)
+                    saved_token = stream.resume_token
+        finally:
+            await self.run_blocking(stream.close)
+
+    async def _poll(self, state):
+        self.active_mode = MODE_POLL
+        last_id = state.get("lastId")
+        if last_id is None:
+            # First run: start from the newest document instead of analyzing the whole history
+            newest = await self.run_blocking(self.collection.find_one, {}, sort=[("_id", -1)])
+            last_id = newest["_id"] if newest else None
+            if last_id is not None:
+                await self.run_blocking(self.save_state, lastId=last_id)
+
+        while True:
+            # Documents with younger ObjectIds may still be preceded by ones not yet visible
+            settled = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=self.poll_lag)) if self.poll_lag > 0 else None
+            batch = await self.run_blocking(self._fetch_after, last_id, settled)
+            if not batch:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            await self._process(batch)
+            last_id = batch[-1]["_id"]
+            await self.run_blocking(self.save_state, lastId=last_id)
+
+    async def _catch_up(self, last_id):
+        """Processes every document after last_id by polling; returns the last _id processed."""
+        if last_id is None:
+            logger.warning("No saved _id to catch up from; documents inserted while the stream was down are skipped")
+            return None
+        caught_up = 0
+        while True:
+            batch = await self.run_blocking(self._fetch_after, last_id)
+            if not batch:
+                logger.info(f"Caught up on {caught_up} activity documents")
+                return last_id
+            await self._process(batch)
+            caught_up += len(batch)
+            last_id = batch[-1]["_id"]
+            await self.run_blocking(self.save_state, lastId=last_id)
+
+    def _fetch_after(self, last_id, before=None):
+        """Returns the next batch of documents with _id after last_id (and below before), in _id order."""
+        id_range = {}
+        if last_id is not None:
+            id_range["$gt"] = last_id
+        if before is not None:
+            id_range["$lt"] = before
+        query = {"_id": id_range} if id_range else {}
+        return list(self.collection.find(query, field_projection(self.fields)).sort("_id", ASCENDING).limit(self.batch_size))
+
+    # --- Processing ---
+
+    def _analyzed_ids(self, document_ids):
+        return {
+            response["documentId"]
+            for response in self.responses_collection.find({"documentId": {"$in": document_ids}}, {"documentId": 1})
+        }
+
+    async def _process(self, documents):
+        analyzed = await self.run_blocking(self._analyzed_ids, [document["_id"] for document in documents])
+
+        tasks = []
+        for document in documents:
+            if document["_id"] in analyzed:
+                self.skipped_duplicate += 1
+                continue
+            script_name = route_document(document)
+            if script_name is None:
+                self.skipped_unrouted += 1
+                continue
+            tasks.append(self.analyze(script_name, document))
+
+        for ok, _ in await asyncio.gather(*tasks):
+            self.processed += 1
+            if not ok:
+                self.failed += 1
+        # The checkpoint moves past these documents, so their responses must be stored first
+        if self.flush is not None:
+            await self.flush()
+        logger.info(f"Ingested {len(documents)} activity documents ({len(tasks)} analyzed)")
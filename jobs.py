@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import socket
+
+from workqueue import ITEM_DONE, ITEM_FAILED, ITEM_LEASED, ITEM_QUEUED, WorkQueue, WorkQueueWorker
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.jobs")
+
+# --- Configuration ---
+# Number of concurrent background job workers per API process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# How often idle workers look for jobs queued by other processes (seconds)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+# Longest long-poll wait allowed on GET /jobs/{job_id} (seconds)
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", 30))
+# Identifies this process in job leases
+JOB_OWNER_ID = os.getenv("JOB_OWNER_ID", f"{socket.gethostname()}-{os.getpid()}")
+# How long a running job stays leased without a heartbeat (seconds)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 30))
+# Claims allowed per job before an expired lease fails it instead of requeueing it
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+# Work queue item state -> job status reported by the API
+JOB_STATUSES = {
+    ITEM_QUEUED: "queued",
+    ITEM_LEASED: "running",
+    ITEM_DONE: "succeeded",
+    ITEM_FAILED: "failed",
+}
+
+FINISHED_STATES = (ITEM_DONE, ITEM_FAILED)
+
+
+def serialize_job(job):
+    """Converts a job document into the API response shape."""
+    response = {
+        "job_id": str(job["_id"]),
+        "script_name": job["script_name"],
+        "object_id": job["object_id"],
+        "status": JOB_STATUSES.get(job["status"], job["status"]),
+        "attempts": job.get("attempts", 0),
+    }
+    for field, key in (("createdAt", "created_at"), ("startedAt", "started_at"), ("finishedAt", "finished_at")):
+        if job.get(field) is not None:
+            response[key] = job[field].isoformat()
+    if job["status"] == ITEM_DONE:
+        response["result"] = job.get("result")
+    elif job["status"] == ITEM_FAILED:
+        response["error"] = job.get("error")
+    return response
+
+
+class JobRunner(WorkQueueWorker):
+    """
+    Background workers that run persisted analysis jobs.
+
+    Jobs are WorkQueue items in the jobs collection, shared by every API process, so
+    they are leased exactly like work queue items: a claimed job is renewed with
+    heartbeats while the analysis runs, and only a job whose lease expired (its process
+    died or stalled) is claimed again. On top of the queue worker, each job records its
+    analyzer response, and get() can wait for a job to finish.
+    """
+
+    def __init__(self, collection, execute, run_blocking, workers=JOB_WORKERS, owner=JOB_OWNER_ID,
+                 lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        """
+        Args:
+            collection: Collection holding the jobs.
+            execute (callable): Coroutine function (script_name, object_id) -> (ok, payload),
+                the same dispatch /execute uses.
+            run_blocking (callable): Coroutine function that runs a blocking call off the event loop.
+            workers (int): Number of concurrent worker loops.
+            owner (str): Lease owner name for this process.
+            lease_seconds (float): Lease duration renewed by each heartbeat.
+            max_attempts (int): Claims allowed per job.
+        """
+        queue = WorkQueue(collection, node_id=owner, lease_seconds=lease_seconds, max_attempts=max_attempts)
+        super().__init__(queue, execute, run_blocking, concurrency=max(1, workers),
+                         poll_interval=JOB_POLL_INTERVAL, store_results=True)
+        self._finished = {}
+
+    async def submit(self, script_name, object_id):
+        """Persists a new job, wakes a worker and returns the job id."""
+        job_id, = await self.run_blocking(self.queue.enqueue, [(script_name, object_id)])
+        logger.info(f"Queued job {job_id} for {script_name} ({object_id})")
+        self.wake()
+        return job_id
+
+    async def get(self, job_id, wait=0):
+        """
+        Returns the job document, optionally waiting up to `wait` seconds for it to finish.
+
+        Returns:
+            dict or None: The job document, or None if it does not exist.
+        """
+        job = await self.run_blocking(self.queue.get, job_id)
+        if job is None or job["status"] in FINISHED_STATES or wait <= 0:
+            return job
+
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            # The job may be run by another process; re-check periodically instead of
+            # relying only on the local completion event
+            deadline = asyncio.get_running_loop().time() + min(wait, JOB_MAX_WAIT)
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+                job = await self.run_blocking(self.queue.get, job_id)
+                if job is None or job["status"] in FINISHED_STATES:
+                    break
+        finally:
+            if not event.is_set() and self._finished.get(job_id) is event:
+                del self._finished[job_id]
+        return job
+
+    async def _process(self, item):
+        await super()._process(item)
+        event = self._finished.pop(str(item["_id"]), None)
+        if event is not None:
+            event.set()
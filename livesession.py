@@ -0,0 +1,199 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+from keymain import KeystrokeTracker
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.livesession")
+
+# --- Configuration ---
+# Sessions without events or open connections for this long are evicted (seconds)
+LIVE_SESSION_IDLE_SECONDS = float(os.getenv("LIVE_SESSION_IDLE_SECONDS", 300))
+# Most sessions kept in memory per process
+LIVE_SESSION_MAX = int(os.getenv("LIVE_SESSION_MAX", 10000))
+
+# Signals combined into the session risk score
+SIGNAL_TYPES = ["key", "paste", "copy", "tab"]
+
+
+def combine_scores(scores):
+    """
+    Combines 0-100 suspicion scores as independent signals: 1 - product of (1 - score / 100).
+
+    Several moderate signals add up, but no combination can exceed 100.
+    """
+    remaining = 1.0
+    for score in scores:
+        remaining *= 1.0 - min(max(score, 0.0), 100.0) / 100.0
+    return round((1.0 - remaining) * 100.0, 2)
+
+
+class SessionLimitReached(Exception):
+    """Raised when LIVE_SESSION_MAX sessions are connected and none can be evicted."""
+
+
+class LiveSession:
+    """
+    Incremental risk state of one proctoring session.
+
+    Keystrokes update a KeystrokeTracker; paste, copy and tab events are scored one at
+    a time by their analyzers and folded in here. Every signal keeps its peak score,
+    and the session risk combines the peaks with combine_scores. All state is
+    fixed-size, so each update is O(1).
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.keystrokes = KeystrokeTracker()
+        self.peaks = {signal: 0.0 for signal in SIGNAL_TYPES}
+        self.event_counts = {signal: 0 for signal in SIGNAL_TYPES}
+        self.connections = 0
+        self.last_seen = time.monotonic()
+
+    def add_key_logs(self, key_logs):
+        """Feeds keystrokes ({'key', 'timestamp'}) to the tracker; returns the keystroke score."""
+        for key_log in key_logs:
+            if isinstance(key_log, dict):
+                self.keystrokes.add(key_log)
+        self.event_counts["key"] += 1
+        self.peaks["key"] = self.keystrokes.score()["suspicious_percentage"]
+        return self.peaks["key"]
+
+    def add_scored_event(self, signal, result):
+        """Folds the analyzer result of a paste, copy or tab event into the session."""
+        self.event_counts[signal] += 1
+        score = float(result.get("suspicion_percentage") or 0.0)
+        self.peaks[signal] = max(self.peaks[signal], score)
+        return score
+
+    def risk_score(self):
+        return combine_scores(self.peaks.values())
+
+    def snapshot(self):
+        """Returns the session's current score as a JSON-compatible dict."""
+        keystrokes = self.keystrokes.score()
+        return {
+            "session_id": self.session_id,
+            "risk_score": self.risk_score(),
+            "signals": {
+                signal: {"peak": round(self.peaks[signal], 2), "events": self.event_counts[signal]}
+                for signal in SIGNAL_TYPES
+            },
+            "keystrokes": keystrokes["details"],
+        }
+
+
+class LiveSessionRegistry:
+    """
+    In-memory sessions ordered by last activity.
+
+    Touching a session moves it to the end, so idle sessions collect at the front and
+    a sweep stops at the first active one. Sessions with an open connection are never
+    evicted; when max_sessions is reached, the least recently active idle session makes
+    room for a new one.
+    """
+
+    def __init__(self, idle_seconds=LIVE_SESSION_IDLE_SECONDS, max_sessions=LIVE_SESSION_MAX):
+        """
+        Args:
+            idle_seconds (float): Inactivity after which a disconnected session is evicted.
+            max_sessions (int): Most sessions kept in memory.
+        """
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max(1, max_sessions)
+        self._sessions = collections.OrderedDict()
+        self._task = None
+
+        self.connected = 0
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_capacity = 0
+        self.events = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def connect(self, session_id):
+        """
+        Returns the session for session_id, creating it if needed, and registers a connection.
+
+        Raises:
+            SessionLimitReached: If the registry is full of connected sessions.
+        """
+        session = self._sessions.get(session_id)
+        if session is None:
+            if len(self._sessions) >= self.max_sessions and not self._evict_one():
+                raise SessionLimitReached(f"Too many live sessions ({self.max_sessions}); retry later")
+            session = self._sessions[session_id] = LiveSession(session_id)
+            self.created += 1
+        session.connections += 1
+        self.connected += 1
+        self.touch(session)
+        return session
+
+    def disconnect(self, session):
+        session.connections -= 1
+        self.connected -= 1
+        self.touch(session)
+
+    def touch(self, session):
+        session.last_seen = time.monotonic()
+        if session.session_id in self._sessions:
+            self._sessions.move_to_end(session.session_id)
+
+    def get(self, session_id):
+        return self._sessions.get(session_id)
+
+    def evict_idle(self):
+        """Evicts disconnected sessions idle for longer than idle_seconds; returns how many."""
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = []
+        for session_id, session in self._sessions.items():
+            if session.last_seen > cutoff:
+                break
+            if session.connections <= 0:
+                idle.append(session_id)
+        for session_id in idle:
+            del self._sessions[session_id]
+        evicted = len(idle)
+        self.evicted_idle += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} idle live sessions")
+        return evicted
+
+    def _evict_one(self):
+        # Least recently active session without an open connection
+        for session_id, session in self._sessions.items():
+            if session.connections <= 0:
+                del self._sessions[session_id]
+                self.evicted_capacity += 1
+                return True
+        return False
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "connections": self.connected,
+            "created": self.created,
+            "events": self.events,
+            "evicted_idle": self.evicted_idle,
+            "evicted_capacity": self.evicted_capacity,
+        }
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self.idle_seconds / 4))
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Live session sweep failed: {str(e)}")
@@ -0,0 +1,131 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.results")
+
+# --- Configuration ---
+# Latest-result lookups kept in memory per API process
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 2048))
+# How long a cached lookup is served; bounds staleness for writes made by other processes (seconds)
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 10))
+# Largest page accepted by GET /results
+RESULTS_PAGE_MAX = int(os.getenv("RESULTS_PAGE_MAX", 100))
+
+
+def serialize_ai_response(response_doc):
+    """Converts an airesponse document into the API response shape."""
+    return {
+        "id": str(response_doc["_id"]),
+        "document_id": str(response_doc["documentId"]),
+        "event_type": response_doc.get("eventType"),
+        "analyzer_version": response_doc.get("analyzerVersion"),
+        "status": response_doc.get("status"),
+        "created_at": response_doc["createdAt"].isoformat() if response_doc.get("createdAt") else None,
+        "response": response_doc.get("response"),
+    }
+
+
+class ResultCache:
+    """
+    Small LRU cache of latest-result lookups keyed by (document_id, event_type).
+
+    Misses are cached too, so a dashboard polling for a result that does not exist
+    yet does not hit MongoDB on every request. Entries are invalidated when this
+    process writes a new response for the document, and expire after ttl seconds
+    to pick up writes made by other processes.
+
+    Each invalidation advances a generation counter. A lookup takes generation()
+    before querying MongoDB and passes it to put(), which drops the value if the key
+    was invalidated in the meantime: the value may predate the write, and caching it
+    would serve the stale result for a full ttl.
+
+    Responses are written from the I/O threads, so access is guarded by a lock.
+    """
+
+    def __init__(self, max_size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        """
+        Args:
+            max_size (int): Entries kept before the least recently used is evicted (0 disables).
+            ttl (float): Lifetime of an entry in seconds.
+        """
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Generation of the latest invalidation per key (bounded like the entries); keys
+        # dropped from it count as invalidated at _forgotten_generation
+        self._generation = 0
+        self._invalidated = collections.OrderedDict()
+        self._forgotten_generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, document_id, event_type=None):
+        """
+        Returns (found, value): found is False when the lookup must go to MongoDB.
+        value is the cached serialized result, or None for a cached miss.
+        """
+        key = (str(document_id), event_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def generation(self):
+        """Current invalidation generation; take it before the MongoDB lookup whose result is put()."""
+        with self._lock:
+            return self._generation
+
+    def put(self, document_id, event_type, value, generation=None):
+        """
+        Caches a lookup result.
+
+        Args:
+            generation (int, optional): generation() taken before the lookup; the value is
+                dropped if the key has been invalidated since.
+        """
+        if not self.max_size:
+            return
+        key = (str(document_id), event_type)
+        with self._lock:
+            if generation is not None and self._invalidated.get(key, self._forgotten_generation) > generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, document_id, event_type):
+        """Drops the lookups a new response for (document_id, event_type) makes stale."""
+        document_id = str(document_id)
+        with self._lock:
+            self._generation += 1
+            for key in ((document_id, event_type), (document_id, None)):
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+                self._invalidated[key] = self._generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > max(self.max_size, 1) * 2:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._forgotten_generation = max(self._forgotten_generation, forgotten)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,131 @@
+import logging
+import os
+
+from analyzers import ANALYZER_FIELDS, EVENT_TYPE_SCRIPTS, TAB_EVENT_TYPES
+from livesession import combine_scores
+from storage import key_log_projection
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.rollup")
+
+# --- Configuration ---
+# Most events of each type analyzed per rollup; later events are left out and the type is flagged truncated
+SESSION_ROLLUP_MAX_EVENTS = int(os.getenv("SESSION_ROLLUP_MAX_EVENTS", 500))
+# Keystroke documents with at least this many key logs are not sent inline: the worker
+# streams them (see KEYLOG_STREAM_THRESHOLD). Kept low because a rollup holds up to
+# SESSION_ROLLUP_MAX_EVENTS of them at once.
+SESSION_ROLLUP_INLINE_KEYLOGS = int(os.getenv("SESSION_ROLLUP_INLINE_KEYLOGS", 2000))
+
+# Event type -> analyzer script run over the session's events of that type
+# (code documents are routed to their language's analyzer per document)
+ROLLUP_SCRIPTS = {
+    "key": "keymain.py",
+    "paste": "paste.py",
+    "copy": "copymain.py",
+    "tab": "tab.py",
+    "code": "py.py",
+}
+
+# Field holding the 0-100 score; the analyzers do not agree on its name
+SCORE_FIELDS = ["suspicion_percentage", "suspicious_percentage", "suspiciousness_percentage"]
+
+
+def build_session_facets(max_events=SESSION_ROLLUP_MAX_EVENTS):
+    """
+    Builds the $facet sub-pipelines that split a session's documents by event type.
+
+    Documents are matched the way analyzers.route_document routes them: copy, paste and
+    tab events by eventType, then keystroke documents by keyLogs and code documents by
+    code. Each facet returns the _ids of up to max_events + 1 documents in insertion
+    order (the extra one flags truncation) and nothing else, so the single facet result
+    stays around 100 kB whatever the documents hold; build_session_projections says
+    which fields are then fetched.
+
+    Returns:
+        dict: Facet name (event type) -> pipeline stages.
+    """
+    routed_event_types = list(EVENT_TYPE_SCRIPTS)
+    matches = {
+        "key": {"eventType": {"$nin": routed_event_types}, "keyLogs.0": {"$exists": True}},
+        "paste": {"eventType": "paste"},
+        "copy": {"eventType": "copy"},
+        "tab": {"eventType": {"$in": TAB_EVENT_TYPES}},
+        "code": {"eventType": {"$nin": routed_event_types}, "keyLogs.0": {"$exists": False}, "code": {"$type": "string", "$ne": ""}},
+    }
+    return {
+        event_type: [
+            {"$match": match},
+            {"$sort": {"_id": 1}},
+            {"$limit": max_events + 1},
+            {"$project": {"_id": 1}},
+        ]
+        for event_type, match in matches.items()
+    }
+
+def build_session_projections(inline_key_logs=SESSION_ROLLUP_INLINE_KEYLOGS):
+    """
+    Returns the $project specification each event type's documents are fetched with:
+    the fields its analyzer reads. keyLogs arrays of inline_key_logs or more entries are
+    replaced by their length, and the worker streams them instead.
+    """
+    projections = {}
+    for event_type, script_name in ROLLUP_SCRIPTS.items():
+        projections[event_type] = {field: 1 for field in ANALYZER_FIELDS[script_name]}
+    projections["key"].update(key_log_projection(inline_key_logs))
+    return projections
+
+def result_score(result):
+    """Returns the 0-100 score of an analyzer result, or None if it has none."""
+    for field in SCORE_FIELDS:
+        value = result.get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+    return None
+
+def summarize_session(username, problem_id, outcomes, truncated):
+    """
+    Combines the per-event analyzer outcomes of a session into one score.
+
+    Each event type contributes its peak score, and the peaks are combined as
+    independent signals (livesession.combine_scores), as for live sessions.
+
+    Args:
+        username (str): The candidate's username.
+        problem_id (str): The session's problem.
+        outcomes (dict): Event type -> list of (object_id, ok, result_or_error_message).
+        truncated (dict): Event type -> True if events beyond the limit were left out.
+
+    Returns:
+        dict: The session score, a breakdown per event type and one compact entry per event
+              (full results are stored and served by GET /results).
+    """
+    by_type = {}
+    events = []
+    for event_type in ROLLUP_SCRIPTS:
+        entries = outcomes.get(event_type, [])
+        scores = []
+        for object_id, ok, payload in entries:
+            if ok:
+                score = result_score(payload)
+                if score is not None:
+                    scores.append(score)
+                events.append({"object_id": object_id, "event_type": event_type, "status": "success", "score": score})
+            else:
+                events.append({"object_id": object_id, "event_type": event_type, "status": "error", "error": payload})
+        by_type[event_type] = {
+            "events": len(entries),
+            "scored": len(scores),
+            "failed": sum(1 for _, ok, _ in entries if not ok),
+            "peak": round(max(scores), 2) if scores else 0.0,
+            "mean": round(sum(scores) / len(scores), 2) if scores else 0.0,
+            "truncated": truncated.get(event_type, False),
+        }
+
+    return {
+        "username": username,
+        "problem_id": problem_id,
+        "risk_score": combine_scores(summary["peak"] for summary in by_type.values()),
+        "events": len(events),
+        "by_type": by_type,
+        "results": events,
+    }
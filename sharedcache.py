@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.sharedcache")
+
+# --- Configuration ---
+# Set to 0 to disable the shared result cache
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "1") == "1"
+# SQLite file shared by every API worker process on the host
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", os.path.join("cache", "results.sqlite3"))
+# Eviction starts once either bound is exceeded, and removes least recently used entries
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", 50000))
+SHARED_CACHE_MAX_MB = float(os.getenv("SHARED_CACHE_MAX_MB", 256))
+
+# Eviction frees down to this fraction of the bounds, so it does not run on every write
+EVICTION_TARGET_RATIO = 0.9
+# A hit refreshes the entry's last access at most this often (seconds), to keep reads mostly read-only
+ACCESS_REFRESH_SECONDS = 60
+# How long a connection waits for another process's write lock (seconds)
+BUSY_TIMEOUT_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals (id, entries, bytes) VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results BEGIN
+    UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS results_update AFTER UPDATE OF size ON results BEGIN
+    UPDATE totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0;
+END;
+"""
+
+
+def content_key(namespace, version, content):
+    """
+    Builds a cache key from a content hash and an analyzer version.
+
+    Args:
+        namespace (str): Kind of analysis, e.g. the event type.
+        version: Analyzer version; bumping it makes older entries unreachable.
+        content (str): The analyzed content.
+    """
+    digest = hashlib.sha256(content.encode("utf-8", "surrogatepass")).hexdigest()
+    return f"{namespace}:{version}:{digest}"
+
+
+class SharedResultCache:
+    """
+    Result cache shared by every worker process on one host, stored in SQLite.
+
+    The database runs in WAL mode, so readers never block the single writer and see
+    only committed entries; writers from different processes serialize on SQLite's
+    file lock (waiting up to BUSY_TIMEOUT_SECONDS). Each thread of each process uses
+    its own connection. Entry and byte totals are kept by triggers in the same
+    transaction as every write, so the size bounds are checked without scanning the
+    table; once a bound is exceeded the least recently used entries are deleted.
+
+    Cache failures are logged and treated as misses, so a broken cache file never
+    fails an analysis.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, max_entries=SHARED_CACHE_MAX_ENTRIES, max_mb=SHARED_CACHE_MAX_MB):
+        """
+        Args:
+            path (str): SQLite database file.
+            max_entries (int): Most entries kept.
+            max_mb (float): Most result bytes kept, in megabytes.
+        """
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, int(max_mb * 1024 * 1024))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def _connection(self):
+        # sqlite3 connections must not be shared across threads or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss.
+
+        Blocking (SQLite I/O); call from a thread when on the event loop.
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value, last_access FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            now = time.time()
+            if now - row[1] > ACCESS_REFRESH_SECONDS:
+                connection.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            self._count("hits")
+            return json.loads(row[0])
+        except (sqlite3.Error, ValueError, OSError) as e:
+            logger.error(f"Shared cache read failed: {str(e)}")
+            self._count("errors")
+            self._count("misses")
+            return None
+
+    def put(self, key, value):
+        """
+        Stores a JSON-compatible value under key, evicting old entries if a bound is exceeded.
+
+        Blocking (SQLite I/O); call from a thread when on the event loop.
+        """
+        try:
+            encoded = json.dumps(value, separators=(",", ":"))
+            connection = self._connection()
+            connection.execute(
+                "INSERT INTO results (key, value, size, last_access) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, size = excluded.size, last_access = excluded.last_access",
+                (key, encoded, len(encoded), time.time()),
+            )
+            self._count("writes")
+            entries, total_bytes = connection.execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+            if entries > self.max_entries or total_bytes > self.max_bytes:
+                self._evict(connection, entries, total_bytes)
+        except (sqlite3.Error, TypeError, ValueError, OSError) as e:
+            logger.error(f"Shared cache write failed: {str(e)}")
+            self._count("errors")
+
+    def _evict(self, connection, entries, total_bytes):
+        # Remove enough least recently used entries to get under both bounds with some headroom
+        excess_entries = entries - int(self.max_entries * EVICTION_TARGET_RATIO)
+        average_size = total_bytes / entries if entries else 1
+        excess_by_bytes = int((total_bytes - self.max_bytes * EVICTION_TARGET_RATIO) / max(average_size, 1)) + 1
+        count = max(excess_entries, excess_by_bytes, 1)
+        cursor = connection.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access LIMIT ?)", (count,))
+        self._count("evicted", cursor.rowcount)
+        logger.info(f"Shared cache evicted {cursor.rowcount} entries ({entries} entries, {total_bytes} bytes before)")
+
+    def stats(self):
+        """Per-process hit/miss counters plus the shared totals (blocking; reads SQLite)."""
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / (self.hits + self.misses), 3) if self.hits + self.misses else 0.0,
+            "writes": self.writes,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+        try:
+            entries, total_bytes = self._connection().execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+            stats.update(entries=entries, bytes=total_bytes)
+        except sqlite3.Error as e:
+            logger.error(f"Shared cache stats failed: {str(e)}")
+        return stats
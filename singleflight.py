@@ -0,0 +1,59 @@
+import asyncio
+import logging
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.singleflight")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight computation.
+
+    The first caller for a key starts the work; callers arriving while it is still
+    running await the same task and receive its result (or exception). The key is
+    forgotten as soon as the work finishes, so later calls start fresh.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, func, *args):
+        """
+        Runs func(*args) for key, or joins the call already in flight for key.
+
+        Args:
+            key (hashable): Identifies duplicate calls.
+            func (callable): Coroutine function that performs the work.
+            *args: Arguments passed to func.
+
+        Returns:
+            The result of the shared call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self._calls[key] = task
+            task.add_done_callback(lambda finished: self._forget(key, finished))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+            logger.info(f"Coalesced duplicate in-flight request: {key}")
+
+        # Shielded so one caller going away does not cancel the work the others wait on
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
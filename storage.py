@@ -0,0 +1,519 @@
+import logging
+import os
+import threading
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from bson.objectid import ObjectId
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.storage")
+
+# --- Configuration ---
+# Required; there is no default so credentials never live in the code
+MONGODB_URL = os.getenv("MONGODB_URL")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "test")
+
+# Connection pool tuning (per process)
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 50))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", 300000))
+
+# Timeouts (milliseconds)
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", 10000))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", 20000))
+
+# Set to 0 to skip creating indexes at startup (e.g. when the database user may not create them)
+MONGODB_ENSURE_INDEXES = os.getenv("MONGODB_ENSURE_INDEXES", "1") == "1"
+
+# Maximum number of ids sent in a single $in query
+FETCH_CHUNK_SIZE = int(os.getenv("MONGODB_FETCH_CHUNK_SIZE", 500))
+# keyLogs entries read per query when a long keystroke session is streamed
+KEYLOG_CHUNK_SIZE = int(os.getenv("KEYLOG_CHUNK_SIZE", 10000))
+# Field holding the keyLogs length in documents fetched with key_log_projection
+KEYLOG_COUNT_FIELD = "keyLogCount"
+
+# MongoDB error code of a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+# Collections
+ACTIVITIES_COLLECTION = "activities"
+AIRESPONSE_COLLECTION = "airesponse"
+JOBS_COLLECTION = "analysisjobs"
+WORKQUEUE_COLLECTION = "workqueue"
+WORKQUEUE_NODES_COLLECTION = "workqueuenodes"
+INGEST_STATE_COLLECTION = "ingeststate"
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+# --- Client ---
+
+def get_client():
+    """
+    Returns the process-wide pooled MongoClient, creating it on first use.
+
+    MongoClient is thread-safe and maintains its own connection pool, so one instance
+    is shared by every caller in the process. A new client is created after a fork,
+    since pymongo clients must not be reused across processes.
+
+    Raises:
+        RuntimeError: If MONGODB_URL is not set.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        if not MONGODB_URL:
+            raise RuntimeError("MONGODB_URL is not set; point it at the MongoDB deployment to use")
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                logger.info(f"Creating MongoDB client (maxPoolSize={MONGODB_MAX_POOL_SIZE}) for pid {pid}")
+                _client = MongoClient(
+                    MONGODB_URL,
+                    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+                    minPoolSize=MONGODB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+                    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+                )
+                _client_pid = pid
+    return _client
+
+def get_database():
+    """Returns the configured database on the shared client."""
+    return get_client()[MONGODB_DATABASE]
+
+def get_collection(name):
+    """Returns a collection of the configured database on the shared client."""
+    return get_database()[name]
+
+def close_client():
+    """Closes the shared client (e.g. on application shutdown)."""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+# --- Indexes ---
+
+# Indexes the service's queries rely on, by collection: (keys, create_index options).
+# ensure_indexes creates them in the background at startup; explain_queries.py checks
+# that every query shape uses one.
+INDEXES = {
+    ACTIVITIES_COLLECTION: [
+        # Session rollups ($match on username + problemId) and per-candidate timelines
+        ([("username", ASCENDING), ("problemId", ASCENDING), ("timestamp", ASCENDING)], {}),
+    ],
+    AIRESPONSE_COLLECTION: [
+        # Latest-result lookups and the ingestion duplicate check
+        ([("documentId", ASCENDING), ("eventType", ASCENDING), ("createdAt", DESCENDING)], {}),
+        # One result per analyzer version; rows stored before versioning are left as they are
+        ([("documentId", ASCENDING), ("eventType", ASCENDING), ("analyzerVersion", ASCENDING)],
+         {"unique": True, "partialFilterExpression": {"analyzerVersion": {"$exists": True}}}),
+    ],
+    # Jobs are work queue items (jobs.JobRunner), so both collections need the same indexes
+    JOBS_COLLECTION: [
+        # WorkQueue.claim (oldest claimable job)
+        ([("status", ASCENDING), ("createdAt", ASCENDING)], {}),
+        # WorkQueue.claim and reclaim_expired (running jobs whose lease ran out)
+        ([("status", ASCENDING), ("leaseExpiresAt", ASCENDING)], {}),
+    ],
+    WORKQUEUE_COLLECTION: [
+        # WorkQueue.claim (oldest claimable item)
+        ([("status", ASCENDING), ("createdAt", ASCENDING)], {}),
+        # WorkQueue.claim and reclaim_expired (leased items whose lease ran out)
+        ([("status", ASCENDING), ("leaseExpiresAt", ASCENDING)], {}),
+    ],
+}
+
+def index_name(keys):
+    """Default MongoDB name of an index on keys, e.g. "documentId_1_createdAt_-1"."""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+def ensure_indexes(indexes=INDEXES):
+    """
+    Creates the declared indexes that do not exist yet (idempotent; called at startup).
+
+    Index builds do not block other reads and writes on current MongoDB versions, but a
+    build on a large collection can take a while, so call this off the request path. An
+    index that conflicts with an existing one (same name, different options) is logged
+    and skipped, so one conflict does not stop the others.
+
+    Returns:
+        dict: "created", "existing" and "failed" lists of "collection.index_name".
+    """
+    report = {"created": [], "existing": [], "failed": []}
+    for collection_name, specs in indexes.items():
+        collection = get_collection(collection_name)
+        present = set(collection.index_information())
+        for keys, options in specs:
+            name = options.get("name") or index_name(keys)
+            qualified = f"{collection_name}.{name}"
+            if name in present:
+                report["existing"].append(qualified)
+                continue
+            try:
+                logger.info(f"Creating index {qualified}")
+                collection.create_index(keys, **{"name": name, **options})
+                report["created"].append(qualified)
+            except OperationFailure as e:
+                logger.error(f"Could not create index {qualified}: {str(e)}")
+                report["failed"].append(qualified)
+    logger.info(f"Indexes ensured: {len(report['created'])} created, {len(report['existing'])} existing, {len(report['failed'])} failed")
+    return report
+
+
+# --- Reads ---
+
+def field_projection(fields):
+    """
+    Builds a find() projection returning only `fields` (plus _id).
+
+    Args:
+        fields (list or None): Top-level field names; None returns whole documents.
+    """
+    if fields is None:
+        return None
+    return {"_id": 1, **{field: 1 for field in fields}}
+
+def fetch_document_by_id(document_id, fields=None):
+    """
+    Fetches an activity document by its _id.
+
+    Args:
+        document_id (str): The document's _id.
+        fields (list, optional): Fields to return (see analyzers.get_required_fields);
+            the whole document when omitted.
+
+    Returns:
+        dict or None: The document, or None if no document has that _id.
+
+    Raises:
+        bson.errors.InvalidId: If document_id is not a valid ObjectId.
+        pymongo.errors.PyMongoError: On connection or query failures.
+    """
+    return get_collection(ACTIVITIES_COLLECTION).find_one({"_id": ObjectId(document_id)}, field_projection(fields))
+
+def fetch_documents_by_ids(document_ids, chunk_size=FETCH_CHUNK_SIZE, fields=None):
+    """
+    Fetches many activity documents with chunked $in queries.
+
+    Args:
+        document_ids (iterable): Document ids as strings; duplicates and invalid ids are skipped.
+        chunk_size (int): Maximum number of ids per query.
+        fields (list, optional): Fields to return; whole documents when omitted.
+
+    Returns:
+        dict: Maps str(_id) -> document for every document that was found.
+    """
+    object_ids = list({ObjectId(document_id) for document_id in document_ids if ObjectId.is_valid(document_id)})
+    collection = get_collection(ACTIVITIES_COLLECTION)
+    projection = field_projection(fields)
+
+    documents = {}
+    for start in range(0, len(object_ids), chunk_size):
+        chunk = object_ids[start:start + chunk_size]
+        for document in collection.find({"_id": {"$in": chunk}}, projection):
+            documents[str(document["_id"])] = document
+    logger.info(f"Fetched {len(documents)}/{len(object_ids)} documents (chunk size {chunk_size})")
+    return documents
+
+def key_log_projection(stream_threshold):
+    """
+    $project fields that return keyLogs only when it has fewer than stream_threshold entries.
+
+    KEYLOG_COUNT_FIELD always holds the array's length (None when keyLogs is missing or
+    not an array), so the server decides in the same round trip whether the array is
+    sent inline or left to be streamed.
+    """
+    key_log_count = {"$cond": [{"$isArray": "$keyLogs"}, {"$size": "$keyLogs"}, None]}
+    return {
+        KEYLOG_COUNT_FIELD: key_log_count,
+        # null sorts below numbers, so a missing array takes the inline branch (and stays missing)
+        "keyLogs": {"$cond": [{"$lt": [key_log_count, stream_threshold]}, "$keyLogs", "$$REMOVE"]},
+    }
+
+def key_log_document_pipeline(document_id, fields, stream_threshold):
+    projection = {field: 1 for field in fields if field != "keyLogs"}
+    return [
+        {"$match": {"_id": ObjectId(document_id)}},
+        {"$project": {**projection, **key_log_projection(stream_threshold)}},
+    ]
+
+def key_log_chunk_pipeline(document_id, position, chunk_size):
+    return [
+        {"$match": {"_id": ObjectId(document_id)}},
+        {"$project": {"_id": 0, "chunk": {"$slice": ["$keyLogs", position, chunk_size]}}},
+    ]
+
+def fetch_key_log_document(document_id, fields, stream_threshold):
+    """
+    Fetches a keystroke document in one round trip, with keyLogs only if it is short.
+
+    Args:
+        document_id (str): The document's _id.
+        fields (list): Fields to return, as for fetch_document_by_id.
+        stream_threshold (int): Arrays of this many entries or more are left out; the
+            document then carries only their length in KEYLOG_COUNT_FIELD.
+
+    Returns:
+        dict or None: The document, or None if no document has that _id.
+
+    Raises:
+        bson.errors.InvalidId: If document_id is not a valid ObjectId.
+    """
+    pipeline = key_log_document_pipeline(document_id, fields, stream_threshold)
+    return next(iter(get_collection(ACTIVITIES_COLLECTION).aggregate(pipeline)), None)
+
+def iter_key_log_chunks(document_id, chunk_size=KEYLOG_CHUNK_SIZE):
+    """
+    Yields an activity document's keyLogs array in slices of chunk_size entries.
+
+    Each slice is a separate $slice query, so only one slice is held in memory at a time.
+    Reading stops at the first short slice, so entries appended meanwhile are picked up
+    as long as the array is append-only.
+
+    Args:
+        document_id: The document's _id.
+        chunk_size (int): Entries per query.
+
+    Yields:
+        list: Consecutive slices of keyLogs.
+    """
+    collection = get_collection(ACTIVITIES_COLLECTION)
+    chunk_size = max(1, chunk_size)
+    position = 0
+    while True:
+        result = next(iter(collection.aggregate(key_log_chunk_pipeline(document_id, position, chunk_size))), None)
+        chunk = (result or {}).get("chunk") or []
+        if chunk:
+            yield chunk
+        position += len(chunk)
+        if len(chunk) < chunk_size:
+            break
+    logger.info(f"Streamed {position} key logs of document {document_id} (chunk size {chunk_size})")
+
+def session_events_pipeline(username, problem_id, facets):
+    return [
+        {"$match": {"username": username, "problemId": problem_id}},
+        {"$facet": facets},
+    ]
+
+def projected_documents_pipeline(object_ids, projection):
+    return [
+        {"$match": {"_id": {"$in": object_ids}}},
+        {"$project": projection},
+    ]
+
+def fetch_projected_documents(object_ids, projection, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Fetches activity documents by _id with an aggregation $project, so the projection
+    may compute fields (e.g. key_log_projection).
+
+    Results come back through a cursor in batches, so only each single document is
+    subject to MongoDB's 16 MB limit.
+
+    Args:
+        object_ids (list): ObjectIds to fetch.
+        projection (dict): $project stage specification.
+        chunk_size (int): Maximum number of ids per query.
+
+    Returns:
+        dict: Maps str(_id) -> document for every document that was found.
+    """
+    collection = get_collection(ACTIVITIES_COLLECTION)
+    documents = {}
+    for start in range(0, len(object_ids), chunk_size):
+        chunk = object_ids[start:start + chunk_size]
+        for document in collection.aggregate(projected_documents_pipeline(chunk, projection)):
+            documents[str(document["_id"])] = document
+    return documents
+
+def fetch_session_events(username, problem_id, facets, projections):
+    """
+    Fetches the activity documents of one candidate's session, grouped by event type.
+
+    The $facet aggregation returns its whole result as one document, which MongoDB caps
+    at 16 MB, so it only selects the ids of each group; the documents themselves are
+    then fetched per group through cursors (fetch_projected_documents).
+
+    Args:
+        username (str): The candidate's username.
+        problem_id (str): The problem the session is for.
+        facets (dict): $facet sub-pipelines by name, each selecting the _ids of one
+            event type's documents in the order they should be returned.
+        projections (dict): Facet name -> $project specification for its documents.
+
+    Returns:
+        dict: Maps each facet name to its list of documents, in facet order (documents
+              deleted in between are left out).
+    """
+    pipeline = session_events_pipeline(username, problem_id, facets)
+    selected = next(iter(get_collection(ACTIVITIES_COLLECTION).aggregate(pipeline)), None) or {}
+
+    grouped = {}
+    for name in facets:
+        object_ids = [row["_id"] for row in selected.get(name, [])]
+        documents = fetch_projected_documents(object_ids, projections[name]) if object_ids else {}
+        grouped[name] = [documents[str(object_id)] for object_id in object_ids if str(object_id) in documents]
+    logger.info(f"Fetched {sum(len(documents) for documents in grouped.values())} session events for {username} ({problem_id})")
+    return grouped
+
+
+# --- Writes ---
+
+def build_ai_response(document_id, event_type, response_data, status="success", analyzer_version=None):
+    """Builds an airesponse document for storage."""
+    return {
+        "documentId": ObjectId(document_id),  # Convert document_id to ObjectId
+        "eventType": event_type,
+        "analyzerVersion": analyzer_version,
+        "response": response_data,
+        "status": status,
+        "createdAt": datetime.utcnow(),  # Store createdAt timestamp
+        "__v": 0  # Explicitly setting __v to 0
+    }
+
+def response_key(response_doc):
+    """The (documentId, eventType, analyzerVersion) filter a stored response is upserted on."""
+    return {
+        "documentId": response_doc["documentId"],
+        "eventType": response_doc["eventType"],
+        "analyzerVersion": response_doc["analyzerVersion"],
+    }
+
+def response_writes(response_doc):
+    """
+    The bulk write requests that store one response.
+
+    A success replaces whatever is stored under its key. An error (timeout, load
+    shedding, failed forced refresh) must not overwrite a good result of the same
+    analyzer version, and must not be added beside it either, whether or not the unique
+    (documentId, eventType, analyzerVersion) index has been built. It is written as an
+    upsert that only inserts ($setOnInsert) when nothing is stored under the key, and an
+    update that overwrites a stored error. A stored success matches neither, and the
+    two give the same result in either order.
+    """
+    key = response_key(response_doc)
+    if response_doc["status"] == "success":
+        return [ReplaceOne(key, response_doc, upsert=True)]
+    return [
+        UpdateOne(key, {"$setOnInsert": response_doc}, upsert=True),
+        UpdateOne({**key, "status": {"$ne": "success"}}, {"$set": response_doc}),
+    ]
+
+def store_ai_responses(response_docs):
+    """
+    Upserts many airesponse documents (built with build_ai_response) in one bulk write.
+
+    Each document replaces the stored result with the same (documentId, eventType,
+    analyzerVersion), except that an error never replaces a success (see
+    response_writes). When a batch holds several documents for one key, the last
+    wins, again unless it is an error and an earlier one is a success.
+
+    Returns:
+        int: Number of documents stored, counting those superseded within the batch.
+    """
+    if not response_docs:
+        return 0
+    latest = {}
+    for response_doc in response_docs:
+        key = tuple(response_key(response_doc).values())
+        kept = latest.get(key)
+        if kept is not None and kept["status"] == "success" and response_doc["status"] != "success":
+            continue
+        latest[key] = response_doc
+    superseded = len(response_docs) - len(latest)
+    requests = []
+    # The response each request writes, by request index
+    written = []
+    for response_doc in latest.values():
+        for request in response_writes(response_doc):
+            requests.append(request)
+            written.append(response_doc)
+    try:
+        # Unordered so one bad document does not stop the rest of the batch
+        result = get_collection(AIRESPONSE_COLLECTION).bulk_write(requests, ordered=False)
+        # An error's no-op request (nothing to insert, or a stored success) modifies nothing
+        stored = result.upserted_count + result.modified_count
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        # An error's insert that lost a race with a concurrent write is expected, not a failure
+        kept = sum(1 for error in write_errors
+                   if error.get("code") == DUPLICATE_KEY_ERROR and written[error["index"]]["status"] != "success")
+        if len(write_errors) > kept:
+            logger.error(f"Error storing some AI responses: {len(write_errors) - kept} failed")
+        stored = e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+    except Exception as e:
+        logger.error(f"Error storing AI responses: {str(e)}")
+        return 0
+    logger.info(f"Stored {stored} AI responses")
+    return stored + superseded
+
+
+# --- Stored Results ---
+
+def fetch_current_response(document_id, event_type, analyzer_version):
+    """
+    Returns the successful stored result of one analyzer version for a document, or None.
+
+    Raises:
+        bson.errors.InvalidId: If document_id is not a valid ObjectId.
+    """
+    return get_collection(AIRESPONSE_COLLECTION).find_one({
+        "documentId": ObjectId(document_id),
+        "eventType": event_type,
+        "analyzerVersion": analyzer_version,
+        "status": "success",
+    })
+
+def fetch_latest_response(document_id, event_type=None):
+    """
+    Returns the newest airesponse for an activity document.
+
+    Args:
+        document_id (str): Activity document id.
+        event_type (str, optional): Restricts the lookup to one event type.
+
+    Returns:
+        dict or None: The airesponse document, or None if there is none.
+
+    Raises:
+        bson.errors.InvalidId: If document_id is not a valid ObjectId.
+    """
+    query = {"documentId": ObjectId(document_id)}
+    if event_type is not None:
+        query["eventType"] = event_type
+    return get_collection(AIRESPONSE_COLLECTION).find_one(query, sort=[("createdAt", DESCENDING)])
+
+def latest_responses_pipeline(document_ids, event_type=None):
+    match = {"documentId": {"$in": [ObjectId(document_id) for document_id in document_ids]}}
+    if event_type is not None:
+        match["eventType"] = event_type
+    return [
+        {"$match": match},
+        {"$sort": {"documentId": ASCENDING, "createdAt": DESCENDING}},
+        {"$group": {"_id": "$documentId", "latest": {"$first": "$$ROOT"}}},
+    ]
+
+def fetch_latest_responses(document_ids, event_type=None):
+    """
+    Returns the newest airesponse for each of many activity documents in one query.
+
+    Args:
+        document_ids (iterable): Valid activity document ids as strings.
+        event_type (str, optional): Restricts the lookup to one event type.
+
+    Returns:
+        dict: Maps str(documentId) -> airesponse document for every id that has one.
+    """
+    pipeline = latest_responses_pipeline(document_ids, event_type)
+    return {str(row["_id"]): row["latest"] for row in get_collection(AIRESPONSE_COLLECTION).aggregate(pipeline)}
@@ -0,0 +1,27 @@
+import os
+import sys
+
+# The service modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pytest imports its own "py" compatibility module at startup, which would shadow the
+# Python analyzer (py.py); pytest keeps its reference, so the name can be released
+if not hasattr(sys.modules.get("py"), "CodeAnalyzer"):
+    sys.modules.pop("py", None)
+
+
+def _ignore_bulk_sort(add):
+    def wrapper(self, *args, sort=None, **kwargs):
+        return add(self, *args, **kwargs)
+    return wrapper
+
+
+# mongomock 4.3 predates the sort argument pymongo 4.11 passes when a bulk write adds
+# an update or replace; the service never sets it, so it can be dropped
+try:
+    from mongomock.collection import BulkOperationBuilder
+except ImportError:
+    pass
+else:
+    BulkOperationBuilder.add_update = _ignore_bulk_sort(BulkOperationBuilder.add_update)
+    BulkOperationBuilder.add_replace = _ignore_bulk_sort(BulkOperationBuilder.add_replace)
@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+from bson.objectid import ObjectId
+
+import main
+from admission import AdmissionController, AdmissionLimiter, AdmissionRejected
+
+
+def test_full_queue_is_shed_at_once():
+    async def scenario():
+        limiter = AdmissionLimiter("code", max_concurrent=1, max_queue=1, queue_timeout=5)
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire()
+        # The queued request still gets the slot once it frees up
+        limiter.release(0.5)
+        await queued
+        return limiter, rejected.value
+
+    limiter, rejected = asyncio.run(scenario())
+
+    assert limiter.rejected_queue_full == 1
+    assert limiter.admitted == 2
+    # One request ahead of it in the queue, plus itself, at the default 1s service time
+    assert rejected.retry_after == 2
+
+
+def test_queued_request_is_shed_after_timeout():
+    async def scenario():
+        limiter = AdmissionLimiter("key", max_concurrent=1, max_queue=4, queue_timeout=0.05)
+        await limiter.acquire()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await limiter.acquire()
+        return limiter, rejected.value
+
+    limiter, rejected = asyncio.run(scenario())
+
+    assert limiter.rejected_timeout == 1
+    assert limiter.waiting == 0
+    assert rejected.retry_after >= 1
+
+
+def test_retry_after_follows_service_time():
+    limiter = AdmissionLimiter("paste", max_concurrent=2, max_queue=4)
+    for _ in range(50):
+        limiter.active += 1
+        limiter.release(6.0)
+    limiter.waiting = 3
+
+    # (3 waiting + 1) / 2 slots, about 6s each
+    assert limiter.retry_after() == 12
+
+
+@pytest.fixture
+def saturated_app(monkeypatch):
+    release = asyncio.Event()
+
+    async def execute_analysis(script_name, object_id):
+        await release.wait()
+        return True, {"object_id": object_id}
+
+    async def lookup_reusable_result(script_name, object_id):
+        return None
+
+    monkeypatch.setattr(main, "admission", AdmissionController(default_concurrency=1, default_queue=0))
+    monkeypatch.setattr(main, "execute_analysis", execute_analysis)
+    monkeypatch.setattr(main, "lookup_reusable_result", lookup_reusable_result)
+    return release
+
+
+def test_execute_answers_429_with_retry_after_when_saturated(saturated_app):
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            running = asyncio.ensure_future(
+                client.post("/execute", json={"script_name": "py.py", "object_id": str(ObjectId())}))
+            while main.admission.limiters["code"].active == 0:
+                await asyncio.sleep(0.01)
+            shed = await client.post("/execute", json={"script_name": "py.py", "object_id": str(ObjectId())})
+            saturated_app.set()
+            return await running, shed
+
+    running, shed = asyncio.run(scenario())
+
+    assert running.status_code == 200
+    assert shed.status_code == 429
+    assert shed.headers["Retry-After"] == "1"
+    assert "retry later" in shed.json()["error"]
+    assert main.admission.stats()["code"]["rejected_queue_full"] == 1
@@ -0,0 +1,76 @@
+import asyncio
+import multiprocessing
+import time
+
+import httpx
+import pytest
+from bson.objectid import ObjectId
+
+import main
+from admission import AdmissionController
+from worker_pool import AnalyzerPool
+
+# Seconds each stub analysis takes, per request
+DURATIONS = [0.3, 0.4, 0.5, 0.6, 0.8, 0.8]
+
+
+def slow_analyzer(script_name, document, time_budget=None, profile="full"):
+    """Stands in for run_analyzer: sleeps for the document's duration in the pool worker."""
+    time.sleep(document["duration"])
+    return {"suspicion_percentage": 0.0, "duration": document["duration"], "profile": profile}
+
+
+@pytest.fixture
+def slow_app(monkeypatch):
+    # A pool with one worker per request, so no request waits for a worker
+    pool = AnalyzerPool(preload=(), size=len(DURATIONS), reserved_workers=0)
+    # Forked workers inherit this process's modules; forkserver workers would re-import
+    # the pytest entry point, whose "py" module clashes with the Python analyzer (py.py)
+    pool._ctx = multiprocessing.get_context("fork")
+    pool.start()
+    documents = {}
+
+    def fetch_analysis_document(script_name, object_id):
+        return documents.get(object_id)
+
+    async def store_response(*args, **kwargs):
+        pass
+
+    monkeypatch.setitem(main.ANALYZERS, "slow.py", slow_analyzer)
+    monkeypatch.setattr(main, "run_analyzer", slow_analyzer)
+    monkeypatch.setattr(main, "analyzer_pool", pool)
+    monkeypatch.setattr(main, "admission", AdmissionController(len(DURATIONS), len(DURATIONS)))
+    monkeypatch.setattr(main, "fetch_analysis_document", fetch_analysis_document)
+    monkeypatch.setattr(main, "fetch_current_response", lambda *args: None)
+    monkeypatch.setattr(main, "store_response", store_response)
+    monkeypatch.setattr(main, "shared_cache", None)
+    try:
+        yield documents
+    finally:
+        pool.shutdown()
+
+
+async def post_all(requests):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        started_at = time.monotonic()
+        responses = await asyncio.gather(*[client.post("/execute", json=request) for request in requests])
+        return responses, time.monotonic() - started_at
+
+
+def test_parallel_requests_finish_in_about_the_slowest_time(slow_app):
+    requests = []
+    for duration in DURATIONS:
+        object_id = str(ObjectId())
+        slow_app[object_id] = {"_id": ObjectId(object_id), "duration": duration}
+        requests.append({"script_name": "slow.py", "object_id": object_id})
+
+    # Warm the pool so worker start-up is not timed
+    asyncio.run(post_all(requests[:1]))
+
+    responses, elapsed = asyncio.run(post_all(requests))
+
+    assert [response.status_code for response in responses] == [200] * len(DURATIONS)
+    assert [response.json()["duration"] for response in responses] == DURATIONS
+    # Serial handling would take sum(DURATIONS) = 3.4s
+    assert elapsed < max(DURATIONS) + 0.5, f"{len(DURATIONS)} parallel requests took {elapsed:.2f}s"
@@ -0,0 +1,212 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure
+
+from ingest import MODE_CHANGE_STREAM, MODE_POLL, IngestWorker
+
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient().db
+
+
+async def run_inline(func, *args, **kwargs):
+    # Yield first, so a worker loop over an in-memory collection cannot starve the test
+    await asyncio.sleep(0)
+    return func(*args, **kwargs)
+
+
+def paste(seconds_ago=0):
+    """An activity document whose ObjectId was generated seconds_ago."""
+    _id = ObjectId.from_datetime(datetime.utcnow() - timedelta(seconds=seconds_ago)) if seconds_ago else ObjectId()
+    return {"_id": _id, "eventType": "paste", "data": "x"}
+
+
+class Recorder:
+    """Analyze callback that stores a response, as the service does, and records each call."""
+
+    def __init__(self, database):
+        self.database = database
+        self.analyzed = []
+
+    async def __call__(self, script_name, document):
+        self.analyzed.append(document["_id"])
+        self.database.airesponse.insert_one({"documentId": document["_id"], "status": "success"})
+        return True, {}
+
+
+def make_worker(database, analyze, collection=None, **options):
+    options.setdefault("poll_interval", 0.01)
+    options.setdefault("poll_lag", 0)
+    return IngestWorker(analyze, run_inline, collection if collection is not None else database.activities,
+                        database.ingeststate, database.airesponse, **options)
+
+
+async def run_until(worker, condition, timeout=5):
+    worker.start()
+    try:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "timed out"
+            await asyncio.sleep(0.01)
+    finally:
+        await worker.stop()
+
+
+def test_polling_starts_at_newest_and_checkpoints_last_id(database):
+    database.activities.insert_one(paste())
+    analyze = Recorder(database)
+
+    async def scenario():
+        worker = make_worker(database, analyze)
+        worker.start()
+        await asyncio.sleep(0.05)
+        new = [paste() for _ in range(3)]
+        database.activities.insert_many(new)
+        await run_until(worker, lambda: len(analyze.analyzed) == 3)
+        return worker, [document["_id"] for document in new]
+
+    worker, new_ids = asyncio.run(scenario())
+
+    # History before the first run is not analyzed
+    assert analyze.analyzed == new_ids
+    assert worker.stats()["mode"] == MODE_POLL
+    assert database.ingeststate.find_one({"_id": "activities"})["lastId"] == new_ids[-1]
+
+
+def test_restart_resumes_after_checkpoint_and_skips_analyzed(database):
+    analyzed, pending = paste(), paste()
+    database.activities.insert_many([analyzed, pending])
+    # A crash after analyzing `analyzed` but before its checkpoint moved past it
+    database.airesponse.insert_one({"documentId": analyzed["_id"], "status": "success"})
+    database.ingeststate.insert_one({"_id": "activities", "lastId": ObjectId.from_datetime(datetime(2000, 1, 1))})
+    analyze = Recorder(database)
+    worker = make_worker(database, analyze)
+
+    asyncio.run(run_until(worker, lambda: worker.skipped_duplicate == 1 and len(analyze.analyzed) == 1))
+
+    assert analyze.analyzed == [pending["_id"]]
+
+
+def test_poll_lag_keeps_out_of_order_ids(database):
+    first = paste(seconds_ago=120)
+    database.activities.insert_one(first)
+    database.ingeststate.insert_one({"_id": "activities", "lastId": ObjectId.from_datetime(datetime(2000, 1, 1))})
+    analyze = Recorder(database)
+
+    async def scenario():
+        worker = make_worker(database, analyze, poll_lag=60)
+        worker.start()
+        # Generated 10s ago: not settled yet, so the checkpoint must not move past it
+        database.activities.insert_one(paste(seconds_ago=10))
+        await asyncio.sleep(0.1)
+        # Generated before it by another writer, but only visible now
+        late = paste(seconds_ago=90)
+        database.activities.insert_one(late)
+        await run_until(worker, lambda: len(analyze.analyzed) == 2)
+        return late
+
+    late = asyncio.run(scenario())
+
+    assert analyze.analyzed == [first["_id"], late["_id"]]
+
+
+class FakeChangeStream:
+    """Replays the inserts into a collection as change events, like pymongo's ChangeStream."""
+
+    def __init__(self, collection, start_after):
+        self.collection = collection
+        self.position = start_after
+        self.resume_token = None
+
+    def try_next(self):
+        query = {"_id": {"$gt": self.position}} if self.position is not None else {}
+        document = self.collection.find_one(query, sort=[("_id", 1)])
+        if document is None:
+            time.sleep(0.001)
+            return None
+        self.position = document["_id"]
+        self.resume_token = {"_data": str(document["_id"])}
+        return {"_id": self.resume_token, "operationType": "insert", "fullDocument": document}
+
+    def close(self):
+        pass
+
+
+class WatchableCollection:
+    """A mongomock collection with watch(); tokens in `lost_tokens` are out of the oplog."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.lost_tokens = []
+        self.resumed_from = []
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def watch(self, pipeline, resume_after=None, max_await_time_ms=None):
+        self.resumed_from.append(resume_after)
+        if resume_after in self.lost_tokens:
+            raise OperationFailure("Resume point no longer in the oplog", code=286)
+        if resume_after is not None:
+            return FakeChangeStream(self.collection, ObjectId(resume_after["_data"]))
+        newest = self.collection.find_one(sort=[("_id", -1)])
+        return FakeChangeStream(self.collection, newest["_id"] if newest else None)
+
+
+def test_change_stream_checkpoints_resume_token(database):
+    collection = WatchableCollection(database.activities)
+    analyze = Recorder(database)
+
+    async def scenario():
+        worker = make_worker(database, analyze, collection)
+        worker.start()
+        await asyncio.sleep(0.05)
+        new = [paste() for _ in range(3)]
+        database.activities.insert_many(new)
+        await run_until(worker, lambda: database.ingeststate.find_one({"lastId": new[-1]["_id"]}) is not None)
+        # Restart: the saved token is passed back to the server
+        restarted = make_worker(database, analyze, collection)
+        later = paste()
+        database.activities.insert_one(later)
+        await run_until(restarted, lambda: len(analyze.analyzed) == 4)
+        return worker, [document["_id"] for document in new + [later]]
+
+    worker, ids = asyncio.run(scenario())
+
+    assert worker.stats()["mode"] == MODE_CHANGE_STREAM
+    assert analyze.analyzed == ids
+    assert collection.resumed_from == [None, {"_data": str(ids[2])}]
+
+
+def test_lost_resume_token_catches_up_by_polling(database):
+    collection = WatchableCollection(database.activities)
+    checkpoint = paste(seconds_ago=60)
+    database.activities.insert_one(checkpoint)
+    stale_token = {"_data": "gone"}
+    collection.lost_tokens.append(stale_token)
+    database.ingeststate.insert_one({"_id": "activities", "resumeToken": stale_token, "lastId": checkpoint["_id"]})
+    # Inserted while the worker was down, after the checkpoint
+    missed = [paste(seconds_ago=30), paste(seconds_ago=20)]
+    database.activities.insert_many(missed)
+    analyze = Recorder(database)
+    worker = make_worker(database, analyze, collection)
+
+    async def scenario():
+        worker.start()
+        await asyncio.sleep(0.1)
+        database.activities.insert_one(paste())
+        await run_until(worker, lambda: len(analyze.analyzed) == 3)
+
+    asyncio.run(scenario())
+
+    # The stale token was tried once, not retried forever
+    assert collection.resumed_from[:2] == [stale_token, None]
+    assert analyze.analyzed[:2] == [document["_id"] for document in missed]
+    assert worker.stats()["history_lost"] == 1
+    assert database.ingeststate.find_one()["resumeToken"] != stale_token
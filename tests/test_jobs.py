@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from jobs import JobRunner, serialize_job
+from workqueue import ITEM_LEASED
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.analysisjobs
+
+
+async def run_inline(func, *args, **kwargs):
+    # mongomock is in-memory; calling it on the loop keeps the test deterministic
+    return func(*args, **kwargs)
+
+
+def make_runner(collection, owner, execute):
+    return JobRunner(collection, execute, run_inline, workers=2, owner=owner, lease_seconds=30)
+
+
+async def wait_until(condition, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_two_runners_run_each_job_once(collection):
+    runs = []
+
+    def executor(owner):
+        async def execute(script_name, object_id):
+            runs.append((owner, object_id))
+            await asyncio.sleep(0.01)
+            return True, {"object_id": object_id, "runner": owner}
+        return execute
+
+    async def scenario():
+        runners = [make_runner(collection, "runner-a", executor("runner-a")),
+                   make_runner(collection, "runner-b", executor("runner-b"))]
+        for runner in runners:
+            await runner.start()
+        job_ids = [await runners[n % 2].submit("py.py", str(n)) for n in range(20)]
+        try:
+            await wait_until(lambda: sum(runner.processed for runner in runners) == len(job_ids))
+            return job_ids, [serialize_job(await runners[0].get(job_id)) for job_id in job_ids], runners
+        finally:
+            for runner in runners:
+                await runner.stop()
+
+    job_ids, jobs, runners = asyncio.run(scenario())
+
+    assert sorted(object_id for _, object_id in runs) == sorted(str(n) for n in range(20))
+    assert {owner for owner, _ in runs} == {"runner-a", "runner-b"}
+    assert all(job["status"] == "succeeded" and job["attempts"] == 1 for job in jobs)
+    assert [job["result"]["object_id"] for job in jobs] == [str(n) for n in range(20)]
+    assert all(runner.lost_leases == 0 for runner in runners)
+
+
+def test_expired_job_is_taken_over_and_stale_outcome_dropped(collection):
+    stalled = asyncio.Event()
+    release = asyncio.Event()
+
+    async def stalling_execute(script_name, object_id):
+        stalled.set()
+        await release.wait()
+        return True, {"runner": "runner-a"}
+
+    async def execute(script_name, object_id):
+        return True, {"runner": "runner-b"}
+
+    async def scenario():
+        first = make_runner(collection, "runner-a", stalling_execute)
+        second = make_runner(collection, "runner-b", execute)
+        await first.start()
+        job_id = await first.submit("py.py", "1")
+        await stalled.wait()
+        await second.start()
+        try:
+            # Held lease: the second runner leaves the job alone
+            await asyncio.sleep(0.05)
+            assert second.processed == 0
+            assert collection.find_one()["status"] == ITEM_LEASED
+
+            # The first runner stops heartbeating: its lease runs out and the job is claimed again
+            collection.update_one({}, {"$set": {"leaseExpiresAt": datetime.utcnow() - timedelta(seconds=1)}})
+            second.wake()
+            finished = await second.get(job_id, wait=5)
+
+            release.set()
+            await wait_until(lambda: first.processed == 1)
+            return serialize_job(finished), serialize_job(await first.get(job_id)), first
+        finally:
+            await first.stop()
+            await second.stop()
+
+    finished, stored, first = asyncio.run(scenario())
+
+    assert (finished["status"], finished["attempts"], finished["result"]) == ("succeeded", 2, {"runner": "runner-b"})
+    # The stalled runner's late outcome does not replace the one recorded by the new owner
+    assert stored["result"] == {"runner": "runner-b"}
+    assert first.lost_leases == 1
+
+
+def test_get_reports_unknown_and_failed_jobs(collection):
+    async def execute(script_name, object_id):
+        return False, "Document not found"
+
+    async def scenario():
+        runner = make_runner(collection, "runner-a", execute)
+        await runner.start()
+        try:
+            job_id = await runner.submit("py.py", "1")
+            return await runner.get("not-an-id"), serialize_job(await runner.get(job_id, wait=5))
+        finally:
+            await runner.stop()
+
+    unknown, job = asyncio.run(scenario())
+
+    assert unknown is None
+    assert (job["status"], job["error"]) == ("failed", "Document not found")
+    assert "started_at" in job and "finished_at" in job
@@ -0,0 +1,83 @@
+import copy
+import random
+
+import pytest
+
+from keymain import KeystrokeTracker, SuspiciousBehaviorDetector
+
+KEYS = ["a", "s", "d", " ", "Control", "v", "Backspace"]
+
+
+def session(length, seed):
+    """Random key logs in time order: typing, pauses, Ctrl+V pairs and fast bursts."""
+    rng = random.Random(seed)
+    timestamp = 1_700_000_000_000.0
+    key_logs = []
+    for _ in range(length):
+        timestamp += rng.choice([10, 20, 45, 60, 120, 250, 900, 20000])
+        key_logs.append({"key": rng.choice(KEYS), "timestamp": timestamp})
+    return key_logs
+
+
+def chunked(key_logs, size=7):
+    return [key_logs[start:start + size] for start in range(0, len(key_logs), size)]
+
+
+def analyze_both(key_logs):
+    detector = SuspiciousBehaviorDetector()
+    # analyze() sorts and converts the logs in place
+    whole = detector.analyze({"keyLogs": copy.deepcopy(key_logs)})
+    stream = detector.analyze_stream(chunked(copy.deepcopy(key_logs)))
+    return whole, stream
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_stream_matches_whole_for_logs_in_time_order(seed):
+    whole, stream = analyze_both(session(500, seed))
+
+    assert stream == whole
+
+
+def test_burst_heavy_session_matches_and_reports_bounded_timestamps():
+    key_logs = [{"key": "Control" if n % 2 == 0 else "v", "timestamp": 1_700_000_000_000.0 + n * 20} for n in range(2000)]
+
+    whole, stream = analyze_both(key_logs)
+
+    assert stream == whole
+    details = stream["details"]
+    assert details["rapid_paste_ctrl_v_count"] == 1000
+    assert details["paste_burst_count"] == 1996
+    # The first and last 50 of each, not every detection
+    assert len(details["rapid_paste_ctrl_v_timestamps"]) == 100
+    assert details["rapid_paste_ctrl_v_timestamps"][:2] == [key_logs[1]["timestamp"], key_logs[3]["timestamp"]]
+    assert details["rapid_paste_ctrl_v_timestamps"][-1] == key_logs[-1]["timestamp"]
+    assert len(details["paste_burst_timestamps"]) == 100
+
+
+def test_tracker_memory_does_not_grow_with_detections():
+    tracker = KeystrokeTracker(record_timestamps=True)
+    for n in range(20000):
+        tracker.add({"key": "Control" if n % 2 == 0 else "v", "timestamp": float(n * 20)})
+
+    assert tracker.rapid_paste_count == 10000
+    assert len(tracker.rapid_paste_timestamps.values()) == 100
+    assert len(tracker.paste_burst_timestamps.values()) == 100
+
+
+def test_stream_skips_out_of_order_logs_instead_of_sorting():
+    key_logs = session(300, seed=7)
+    shuffled = list(key_logs)
+    # Swap a few neighbours, as a client retrying a batch of keystrokes might
+    for position in (20, 90, 150, 220):
+        shuffled[position], shuffled[position + 1] = shuffled[position + 1], shuffled[position]
+
+    whole, _ = analyze_both(key_logs)
+    whole_shuffled, stream_shuffled = analyze_both(shuffled)
+
+    # analyze() sorts, so the order the logs arrive in does not matter
+    assert whole_shuffled == whole
+    # analyze_stream() keeps every key press but drops each interval that goes back in time
+    backwards = sum(1 for before, after in zip(shuffled, shuffled[1:]) if after["timestamp"] < before["timestamp"])
+    assert backwards == 4
+    assert stream_shuffled["details"]["total_key_presses"] == whole["details"]["total_key_presses"]
+    assert stream_shuffled["details"]["analyzed_intervals"] == len(shuffled) - 1 - backwards
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import main
+from livesession import LiveSessionRegistry, SessionLimitReached, combine_scores
+
+
+def test_idle_disconnected_sessions_are_evicted():
+    registry = LiveSessionRegistry(idle_seconds=0.05)
+    idle = registry.connect("idle")
+    registry.disconnect(idle)
+    registry.connect("connected")
+    time.sleep(0.1)
+
+    assert registry.evict_idle() == 1
+    assert registry.get("idle") is None
+    # An open connection keeps a session however long it is quiet
+    assert registry.get("connected") is not None
+    assert registry.stats()["evicted_idle"] == 1
+
+
+def test_full_registry_evicts_idle_session_or_rejects():
+    registry = LiveSessionRegistry(max_sessions=2)
+    first = registry.connect("first")
+    registry.connect("second")
+
+    with pytest.raises(SessionLimitReached):
+        registry.connect("third")
+
+    registry.disconnect(first)
+    registry.connect("third")
+    assert registry.get("first") is None
+    assert registry.stats()["evicted_capacity"] == 1
+    # Reconnecting to a known session never needs room
+    assert registry.connect("second") is registry.get("second")
+
+
+def test_combine_scores_adds_up_below_100():
+    assert combine_scores([0, 0]) == 0
+    assert combine_scores([50, 50]) == 75
+    assert combine_scores([100, 30, 250]) == 100
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Lifespan events do not run outside a `with` block, so no MongoDB is needed
+    monkeypatch.setattr(main, "live_sessions", LiveSessionRegistry(max_sessions=1))
+    return TestClient(main.app)
+
+
+def test_keystrokes_are_scored_live(client):
+    with client.websocket_connect("/sessions/s1/live") as websocket:
+        assert websocket.receive_json()["risk_score"] == 0
+        websocket.send_json({"keyLogs": [{"key": "a", "timestamp": 1000}, {"key": "b", "timestamp": 1140}]})
+        message = websocket.receive_json()
+
+    assert (message["type"], message["event_type"]) == ("score", "key")
+    assert message["signals"]["key"]["events"] == 1
+    assert main.live_sessions.stats()["events"] == 1
+
+
+def test_connection_over_limit_is_closed_with_1013(client):
+    with client.websocket_connect("/sessions/s1/live") as websocket:
+        websocket.receive_json()
+        with client.websocket_connect("/sessions/s2/live") as rejected:
+            with pytest.raises(WebSocketDisconnect) as closed:
+                rejected.receive_json()
+    assert closed.value.code == 1013
+
+
+def test_binary_frame_closes_with_1003(client):
+    with client.websocket_connect("/sessions/s1/live") as websocket:
+        websocket.receive_json()
+        websocket.send_bytes(b"\x81\xa3key")
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+    assert closed.value.code == 1003
+    # The session outlives the connection, ready for a reconnect
+    assert main.live_sessions.get("s1").connections == 0
@@ -0,0 +1,80 @@
+import multiprocessing
+import sqlite3
+
+from sharedcache import SharedResultCache
+
+PROCESSES = 6
+KEYS_PER_PROCESS = 200
+# Keys every process writes, so writers also collide on the same rows
+SHARED_KEYS = 20
+
+
+def value_for(key):
+    return {"key": key, "factors": list(range(20)), "text": key * 10}
+
+
+def hammer(path, number, max_entries):
+    """Writes this process's keys and the shared ones while reading everyone's; returns its stats."""
+    cache = SharedResultCache(path=path, max_entries=max_entries)
+    corrupted = 0
+    for n in range(KEYS_PER_PROCESS):
+        key = f"p{number}:{n}"
+        cache.put(key, value_for(key))
+        shared = f"shared:{n % SHARED_KEYS}"
+        cache.put(shared, value_for(shared))
+        # Another process's key: a miss (not written yet, or evicted) or exactly its value
+        other = f"p{(number + 1) % PROCESSES}:{n}"
+        value = cache.get(other)
+        if value is not None and value != value_for(other):
+            corrupted += 1
+    return {**cache.stats(), "corrupted": corrupted}
+
+
+def run_processes(path, max_entries):
+    # Forked workers inherit this process's modules (a spawned one would re-import the
+    # pytest entry point, whose "py" module clashes with the Python analyzer py.py)
+    with multiprocessing.get_context("fork").Pool(PROCESSES) as pool:
+        return pool.starmap(hammer, [(path, number, max_entries) for number in range(PROCESSES)])
+
+
+def read_table(path):
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT key, value, size FROM results").fetchall()
+        totals = connection.execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+    return rows, totals
+
+
+def test_concurrent_writers_and_readers_lose_nothing(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+
+    stats = run_processes(path, max_entries=100000)
+
+    # No "database is locked" (or any other) error was swallowed, and no read was corrupted
+    assert [process["errors"] for process in stats] == [0] * PROCESSES
+    assert [process["corrupted"] for process in stats] == [0] * PROCESSES
+
+    cache = SharedResultCache(path=path)
+    expected = [f"p{number}:{n}" for number in range(PROCESSES) for n in range(KEYS_PER_PROCESS)]
+    expected += [f"shared:{n}" for n in range(SHARED_KEYS)]
+    assert all(cache.get(key) == value_for(key) for key in expected)
+
+    rows, totals = read_table(path)
+    assert len(rows) == len(expected)
+    assert totals == (len(rows), sum(size for _, _, size in rows))
+
+
+def test_concurrent_eviction_keeps_totals_consistent(tmp_path):
+    path = str(tmp_path / "results.sqlite3")
+
+    stats = run_processes(path, max_entries=300)
+
+    assert [process["errors"] for process in stats] == [0] * PROCESSES
+    assert [process["corrupted"] for process in stats] == [0] * PROCESSES
+    assert sum(process["evicted"] for process in stats) > 0
+
+    rows, totals = read_table(path)
+    # Bounded, and the trigger-maintained totals match the table exactly
+    assert len(rows) <= 300
+    assert totals == (len(rows), sum(size for _, _, size in rows))
+    cache = SharedResultCache(path=path)
+    assert all(cache.get(key) == value_for(key) for key, _, _ in rows)
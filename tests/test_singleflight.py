@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+import main
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*[flight.do("key", work, 21) for _ in range(5)])
+        # Finished calls are forgotten: the next one runs again
+        again = await flight.do("key", work, 21)
+        return flight, results, again
+
+    flight, results, again = asyncio.run(scenario())
+
+    assert results == [42] * 5 and again == 42
+    assert calls == [21, 21]
+    assert flight.stats() == {"in_flight": 0, "executed": 2, "coalesced": 4}
+
+
+def test_exception_reaches_every_caller_and_cancelled_caller_does_not_cancel_work():
+    release = asyncio.Event()
+
+    async def failing():
+        await release.wait()
+        raise ValueError("analysis failed")
+
+    async def scenario():
+        flight = SingleFlight()
+        leaving = asyncio.ensure_future(flight.do("key", failing))
+        staying = asyncio.ensure_future(flight.do("key", failing))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(ValueError):
+            await staying
+        return flight
+
+    flight = asyncio.run(scenario())
+
+    assert flight.stats() == {"in_flight": 0, "executed": 1, "coalesced": 1}
+
+
+@pytest.fixture
+def blocked_analyses(monkeypatch):
+    """Replaces execute_analysis with one that records its arguments and waits for release."""
+    calls = []
+    release = asyncio.Event()
+
+    async def execute_analysis(script_name, object_id, *args):
+        calls.append((script_name, object_id) + args)
+        await release.wait()
+        return True, {"object_id": object_id}
+
+    monkeypatch.setattr(main, "in_flight_analyses", SingleFlight())
+    monkeypatch.setattr(main, "execute_analysis", execute_analysis)
+    return calls, release
+
+
+def test_dispatch_paths_coalesce_only_within_their_own_key(blocked_analyses):
+    calls, release = blocked_analyses
+    object_id = "0123456789abcdef01234567"
+
+    async def scenario():
+        pending = [
+            main.execute_job("py.py", object_id),
+            main.execute_job("py.py", object_id),
+            main.execute_backfill("py.py", object_id),
+            main.execute_backfill("py.py", object_id),
+            main.ingest_document("py.py", {"_id": object_id}),
+        ]
+        tasks = [asyncio.ensure_future(call) for call in pending]
+        await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(scenario())
+
+    assert all(ok for ok, _ in results)
+    assert main.in_flight_analyses.stats() == {"in_flight": 0, "executed": 3, "coalesced": 2}
+    # Each path ran its own analysis: jobs in their event type's lane, backfill in the
+    # backfill lane, ingestion on the delivered document
+    assert sorted(calls, key=len) == sorted([
+        ("py.py", object_id),
+        ("py.py", object_id, main.LANE_BACKFILL),
+        ("py.py", object_id, None, {"_id": object_id}),
+    ], key=len)
+
+
+def test_coalescing_keys_differ_per_dispatch_path():
+    paths = [main.DISPATCH_EXECUTE, main.DISPATCH_JOB, main.DISPATCH_WORKQUEUE, main.DISPATCH_STREAM, main.DISPATCH_INGEST]
+
+    keys = {main.coalescing_key(path, "py.py", "1") for path in paths}
+
+    assert len(keys) == len(paths)
+    assert main.coalescing_key(main.DISPATCH_JOB, "py.py", "1") == main.coalescing_key(main.DISPATCH_JOB, "py.py", "1")
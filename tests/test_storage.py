@@ -0,0 +1,59 @@
+import mongomock
+import pytest
+from bson.objectid import ObjectId
+
+import storage
+from storage import build_ai_response, ensure_indexes, fetch_latest_response, store_ai_responses
+
+
+@pytest.fixture(params=["with index", "without index"])
+def airesponse(request, monkeypatch):
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(storage, "get_collection", lambda name: database[name])
+    if request.param == "with index":
+        ensure_indexes({storage.AIRESPONSE_COLLECTION: storage.INDEXES[storage.AIRESPONSE_COLLECTION]})
+    return database[storage.AIRESPONSE_COLLECTION]
+
+
+def response(document_id, status, **data):
+    return build_ai_response(document_id, "code", data, status, 1)
+
+
+def test_error_never_replaces_or_joins_a_stored_success(airesponse):
+    document_id = str(ObjectId())
+
+    assert store_ai_responses([response(document_id, "error", error="timeout")]) == 1
+    assert store_ai_responses([response(document_id, "success", score=42)]) == 1
+    assert store_ai_responses([response(document_id, "error", error="shed")]) == 0
+
+    stored = list(airesponse.find())
+    assert len(stored) == 1
+    assert (stored[0]["status"], stored[0]["response"]) == ("success", {"score": 42})
+    assert fetch_latest_response(document_id)["response"] == {"score": 42}
+
+
+def test_error_replaces_a_stored_error(airesponse):
+    document_id = str(ObjectId())
+
+    store_ai_responses([response(document_id, "error", error="timeout")])
+    assert store_ai_responses([response(document_id, "error", error="shed")]) == 1
+
+    stored = list(airesponse.find())
+    assert len(stored) == 1
+    assert (stored[0]["status"], stored[0]["response"]) == ("error", {"error": "shed"})
+
+
+def test_batch_keeps_success_over_later_error_for_the_same_key(airesponse):
+    document_id, other_id = str(ObjectId()), str(ObjectId())
+
+    stored = store_ai_responses([
+        response(document_id, "success", score=1),
+        response(document_id, "error", error="timeout"),
+        response(other_id, "error", error="not found"),
+    ])
+
+    assert stored == 3
+    rows = {str(row["documentId"]): row for row in airesponse.find()}
+    assert len(rows) == 2
+    assert rows[document_id]["status"] == "success"
+    assert rows[other_id]["response"] == {"error": "not found"}
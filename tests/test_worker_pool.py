@@ -0,0 +1,88 @@
+import multiprocessing
+import time
+from collections import Counter
+
+import pytest
+
+from worker_pool import AnalyzerPool
+
+LANE_WEIGHTS = {"live": 6, "code": 3, "backfill": 1}
+
+
+def noop():
+    return None
+
+
+def sleep_then_return(seconds, value):
+    time.sleep(seconds)
+    return value
+
+
+def make_pool(size, reserved_workers):
+    pool = AnalyzerPool(preload=(), size=size, lane_weights=LANE_WEIGHTS, reserved_workers=reserved_workers)
+    # Forked workers inherit this process's modules; forkserver workers would re-import
+    # the pytest entry point, whose "py" module clashes with the Python analyzer (py.py)
+    pool._ctx = multiprocessing.get_context("fork")
+    return pool
+
+
+def test_backlogged_lanes_are_served_by_weight():
+    # Not started: _next_job is called directly, so every pop is a scheduling decision
+    pool = make_pool(size=4, reserved_workers=0)
+    for lane, jobs in (("live", 12), ("code", 30), ("backfill", 30)):
+        for _ in range(jobs):
+            pool.submit(noop, lane=lane)
+
+    rounds = [Counter(pool._next_job()[0] for _ in range(10)) for _ in range(2)]
+    # Once the live lane runs dry the others keep their 3:1 ratio
+    later = Counter(pool._next_job()[0] for _ in range(12))
+
+    assert rounds == [{"live": 6, "code": 3, "backfill": 1}] * 2
+    assert pool.queue_depth("live") == 0
+    assert later == {"code": 9, "backfill": 3}
+    assert pool.stats()["lanes"]["live"]["dispatched"] == 12
+
+
+def test_cancelled_queued_job_is_skipped():
+    pool = make_pool(size=1, reserved_workers=0)
+    cancelled = pool.submit(noop, lane="code")
+    kept = pool.submit(noop, lane="code")
+    cancelled.cancel()
+
+    lane, job_id, func, args, timeout, future = pool._next_job()
+
+    assert future is kept
+    assert pool._next_job() is None
+
+
+def test_reserved_worker_runs_live_job_behind_a_code_backlog():
+    pool = make_pool(size=2, reserved_workers=1)
+    pool.start()
+    try:
+        # Warm both workers so process start-up is not timed
+        for future in [pool.submit(noop, lane="live"), pool.submit(noop, lane="live")]:
+            future.result(timeout=10)
+
+        code_jobs = [pool.submit(sleep_then_return, 1.0, n, lane="code") for n in range(3)]
+        time.sleep(0.2)
+        stats = pool.stats()
+        started = time.monotonic()
+        live_result = pool.submit(sleep_then_return, 0, "live", lane="live").result(timeout=10)
+        live_seconds = time.monotonic() - started
+
+        # Only one code job may hold a worker; the other is kept for the live lane
+        assert stats["lanes"]["code"]["busy"] == 1
+        assert stats["lanes"]["code"]["pending"] == 2
+        assert live_result == "live"
+        assert live_seconds < 0.5, f"live job waited {live_seconds:.2f}s behind the code backlog"
+        assert not any(future.done() for future in code_jobs[1:])
+        assert [future.result(timeout=10) for future in code_jobs] == [0, 1, 2]
+    finally:
+        pool.shutdown()
+
+
+def test_unknown_lane_is_rejected():
+    pool = make_pool(size=1, reserved_workers=0)
+
+    with pytest.raises(ValueError):
+        pool.submit(noop, lane="batch")
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+from workqueue import ITEM_DONE, ITEM_FAILED, ITEM_LEASED, ITEM_QUEUED, WorkQueue
+
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient().db
+
+
+def make_queue(database, node_id, max_attempts=3):
+    return WorkQueue(database.workqueue, database.workqueuenodes, node_id=node_id, lease_seconds=30, max_attempts=max_attempts)
+
+
+def expire_lease(queue, item_id):
+    """Moves an item's lease expiry into the past, as if its owner stopped heartbeating."""
+    queue.collection.update_one({"_id": item_id}, {"$set": {"leaseExpiresAt": datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_claim_leases_oldest_item_to_this_node(database):
+    queue = make_queue(database, "node-a")
+    first, second = queue.enqueue([("py.py", "1"), ("paste.py", "2")])
+
+    item = queue.claim()
+
+    assert str(item["_id"]) == first
+    assert item["status"] == ITEM_LEASED
+    assert item["leaseOwner"] == "node-a"
+    assert item["attempts"] == 1
+    assert item["leaseExpiresAt"] > datetime.utcnow()
+    assert str(queue.claim()["_id"]) == second
+    assert queue.claim() is None
+
+
+def test_heartbeat_extends_only_own_lease(database):
+    queue = make_queue(database, "node-a")
+    other = make_queue(database, "node-b")
+    queue.enqueue([("py.py", "1")])
+    item = queue.claim()
+    expire_lease(queue, item["_id"])
+
+    assert other.heartbeat(item["_id"]) is False
+    assert queue.heartbeat(item["_id"]) is True
+    assert queue.collection.find_one({"_id": item["_id"]})["leaseExpiresAt"] > datetime.utcnow()
+    # A renewed lease is not claimable
+    assert other.claim() is None
+
+
+def test_complete_marks_item_done_or_failed(database):
+    queue = make_queue(database, "node-a")
+    queue.enqueue([("py.py", "1"), ("py.py", "2")])
+    done, failed = queue.claim(), queue.claim()
+
+    assert queue.complete(done["_id"], True) is True
+    assert queue.complete(failed["_id"], False, "analyzer crashed") is True
+
+    done, failed = queue.collection.find_one({"_id": done["_id"]}), queue.collection.find_one({"_id": failed["_id"]})
+    assert (done["status"], done["finishedBy"], "leaseExpiresAt" in done) == (ITEM_DONE, "node-a", False)
+    assert (failed["status"], failed["error"]) == (ITEM_FAILED, "analyzer crashed")
+    # Finished items are never claimed again, and cannot be completed twice
+    assert queue.claim() is None
+    assert queue.complete(done["_id"], True) is False
+
+
+def test_expired_lease_is_claimable_by_another_node(database):
+    queue = make_queue(database, "node-a")
+    other = make_queue(database, "node-b")
+    queue.enqueue([("py.py", "1")])
+    item = queue.claim()
+
+    # Held lease: the other node finds nothing
+    assert other.claim() is None
+
+    expire_lease(queue, item["_id"])
+    reclaimed = other.claim()
+
+    assert reclaimed["_id"] == item["_id"]
+    assert (reclaimed["leaseOwner"], reclaimed["attempts"]) == ("node-b", 2)
+    # The first node lost the lease: its heartbeat and completion are refused
+    assert queue.heartbeat(item["_id"]) is False
+    assert queue.complete(item["_id"], True) is False
+    assert other.complete(item["_id"], True) is True
+    assert queue.collection.find_one({"_id": item["_id"]})["finishedBy"] == "node-b"
+
+
+def test_reclaim_expired_requeues_and_fails_out_of_attempts(database):
+    queue = make_queue(database, "node-a", max_attempts=2)
+    queue.enqueue([("py.py", "retry"), ("py.py", "exhausted"), ("py.py", "held")])
+    items = {item["object_id"]: item["_id"] for item in (queue.claim() for _ in range(3))}
+    queue.collection.update_one({"_id": items["exhausted"]}, {"$set": {"attempts": 2}})
+    expire_lease(queue, items["retry"])
+    expire_lease(queue, items["exhausted"])
+
+    assert queue.reclaim_expired() == (1, 1)
+
+    stored = {item["object_id"]: item for item in queue.collection.find()}
+    assert stored["retry"]["status"] == ITEM_QUEUED and "leaseOwner" not in stored["retry"]
+    assert (stored["exhausted"]["status"], stored["exhausted"]["error"]) == (ITEM_FAILED, "Lease expired too many times")
+    assert stored["held"]["status"] == ITEM_LEASED
+    assert queue.stats()["items"] == {ITEM_QUEUED: 1, ITEM_LEASED: 1, ITEM_DONE: 0, ITEM_FAILED: 1}
+
+
+def test_competing_nodes_claim_each_item_once(database):
+    nodes = [make_queue(database, "node-a"), make_queue(database, "node-b")]
+    item_ids = nodes[0].enqueue([("py.py", str(n)) for n in range(20)])
+
+    claimed = {}
+    turn = 0
+    while True:
+        item = nodes[turn % 2].claim()
+        if item is None:
+            break
+        assert item["_id"] not in claimed
+        claimed[item["_id"]] = item["leaseOwner"]
+        turn += 1
+
+    assert sorted(str(item_id) for item_id in claimed) == sorted(item_ids)
+    assert set(claimed.values()) == {"node-a", "node-b"}
+    assert all(node.claim() is None for node in nodes)
@@ -0,0 +1,144 @@
+import asyncio
+
+from writebehind import WriteBehindBuffer
+
+
+class Database:
+    """Records every batch; writes wait while `blocked` is clear, like a slow database."""
+
+    def __init__(self):
+        self.batches = []
+        self.blocked = asyncio.Event()
+        self.blocked.set()
+        self.fail = False
+
+    async def run_blocking(self, func, *args):
+        await self.blocked.wait()
+        return func(*args)
+
+    def write(self, documents):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.batches.append(list(documents))
+        return len(documents)
+
+
+async def wait_until(condition, timeout=5):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.005)
+
+
+def make_buffer(database, **options):
+    return WriteBehindBuffer(database.write, database.run_blocking, **options)
+
+
+def test_full_batch_is_flushed_without_waiting_for_the_interval():
+    async def scenario():
+        database = Database()
+        buffer = make_buffer(database, flush_size=3, flush_interval=60)
+        buffer.start()
+        for n in range(4):
+            await buffer.put(n)
+        await wait_until(lambda: database.batches)
+        await asyncio.sleep(0.05)
+        stats = buffer.stats()
+        await buffer.stop()
+        return database, stats
+
+    database, stats = asyncio.run(scenario())
+
+    assert stats["buffered"] == 1
+    # The remainder is written on shutdown
+    assert database.batches == [[0, 1, 2], [3]]
+
+
+def test_partial_batch_is_flushed_after_the_interval():
+    async def scenario():
+        database = Database()
+        buffer = make_buffer(database, flush_size=100, flush_interval=0.05)
+        buffer.start()
+        await buffer.put("a")
+        await buffer.put("b")
+        started = asyncio.get_running_loop().time()
+        await wait_until(lambda: database.batches)
+        waited = asyncio.get_running_loop().time() - started
+        await buffer.stop()
+        return database, waited, buffer.stats()
+
+    database, waited, stats = asyncio.run(scenario())
+
+    assert database.batches == [["a", "b"]]
+    assert 0.03 <= waited < 1
+    assert (stats["flushes"], stats["written"], stats["failed"]) == (1, 2, 0)
+
+
+def test_full_buffer_makes_put_wait_for_a_flush():
+    async def scenario():
+        database = Database()
+        database.blocked.clear()
+        buffer = make_buffer(database, max_size=4, flush_size=2, flush_interval=60)
+        buffer.start()
+        # The first batch is taken and held up by the slow database
+        for n in range(2):
+            await buffer.put(n)
+        await asyncio.sleep(0.01)
+        for n in range(2, 6):
+            await buffer.put(n)
+        waiting = asyncio.ensure_future(buffer.put(6))
+        await asyncio.sleep(0.05)
+        blocked_stats = buffer.stats()
+        put_done_while_blocked = waiting.done()
+
+        database.blocked.set()
+        await waiting
+        await buffer.stop()
+        return database, blocked_stats, put_done_while_blocked, buffer.stats()
+
+    database, blocked_stats, put_done_while_blocked, stats = asyncio.run(scenario())
+
+    assert not put_done_while_blocked
+    assert blocked_stats["buffered"] == 4
+    assert stats["backpressure_waits"] == 1
+    assert [document for batch in database.batches for document in batch] == list(range(7))
+    assert stats["max_batch_size"] == 2
+
+
+def test_stop_flushes_everything_buffered():
+    async def scenario():
+        database = Database()
+        buffer = make_buffer(database, flush_size=100, flush_interval=60)
+        buffer.start()
+        for n in range(5):
+            await buffer.put(n)
+        await buffer.stop()
+        # A put after the background task stopped is written by the final flush
+        await buffer.put(5)
+        await buffer.stop()
+        return database, buffer.stats()
+
+    database, stats = asyncio.run(scenario())
+
+    assert database.batches == [[0, 1, 2, 3, 4], [5]]
+    assert stats["buffered"] == 0
+
+
+def test_failed_write_is_counted_and_buffer_keeps_going():
+    async def scenario():
+        database = Database()
+        database.fail = True
+        buffer = make_buffer(database, flush_size=2, flush_interval=60)
+        buffer.start()
+        await buffer.put(0)
+        await buffer.put(1)
+        await wait_until(lambda: buffer.failed == 2)
+        database.fail = False
+        await buffer.put(2)
+        await buffer.stop()
+        return database, buffer.stats()
+
+    database, stats = asyncio.run(scenario())
+
+    assert database.batches == [[2]]
+    assert (stats["written"], stats["failed"]) == (1, 2)
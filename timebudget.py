@@ -0,0 +1,40 @@
+import time
+
+
+class TimeBudget:
+    """
+    Wall-clock budget for one analysis, checked between factor stages.
+
+    Analyzers call allows(factor) before each stage; once the budget is spent the
+    remaining factors are skipped and recorded, and annotate() flags the result as
+    partial so the caller still gets the factors that finished.
+    """
+
+    def __init__(self, seconds=None):
+        """
+        Args:
+            seconds (float, optional): Time allowed for the analysis; None means unlimited.
+        """
+        self.deadline = None if seconds is None else time.monotonic() + seconds
+        self.skipped = []
+
+    def exhausted(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def allows(self, factor):
+        """Returns True if the stage for `factor` may run; otherwise records it as skipped."""
+        if self.exhausted():
+            self.skipped.append(factor)
+            return False
+        return True
+
+    @property
+    def partial(self):
+        return bool(self.skipped)
+
+    def annotate(self, result):
+        """Adds partial/skipped_factors to a result dict when any factor was skipped."""
+        if self.skipped:
+            result["partial"] = True
+            result["skipped_factors"] = list(self.skipped)
+        return result
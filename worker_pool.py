@@ -0,0 +1,441 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.worker_pool")
+
+# --- Configuration ---
+# Number of long-lived worker processes
+POOL_SIZE = int(os.getenv("ANALYZER_POOL_SIZE", os.cpu_count() or 2))
+# Hard per-job deadline (seconds); a worker still busy past it is killed and replaced
+JOB_TIMEOUT_SECONDS = float(os.getenv("ANALYZER_JOB_TIMEOUT", 10))
+# Recycle a worker after it has completed this many jobs
+MAX_JOBS_PER_WORKER = int(os.getenv("ANALYZER_MAX_JOBS_PER_WORKER", 500))
+# Recycle a worker once its resident memory passes this ceiling (megabytes)
+MAX_WORKER_RSS_MB = float(os.getenv("ANALYZER_MAX_WORKER_RSS_MB", 512))
+
+# Priority lanes and their scheduling weights ("lane:weight,..."). A free worker takes
+# its next job from the non-empty lanes by smooth weighted round-robin, so a lane with
+# weight 6 is served six times as often as a lane with weight 1 while both are backlogged.
+LANE_WEIGHTS = {
+    lane: int(weight)
+    for lane, weight in (entry.split(":") for entry in os.getenv("ANALYZER_LANE_WEIGHTS", "live:6,code:3,backfill:1").split(","))
+}
+DEFAULT_LANE = "code"
+# Lane that always has workers available: other lanes may not occupy the last N workers
+RESERVED_LANE = "live"
+RESERVED_WORKERS = int(os.getenv("ANALYZER_RESERVED_LIVE_WORKERS", 1))
+
+
+class WorkerPoolError(Exception):
+    """Base class for failures raised by the pool rather than by the analyzer."""
+
+class WorkerTimeoutError(WorkerPoolError):
+    """Raised when a job exceeds its deadline and its worker is killed."""
+
+class WorkerCrashedError(WorkerPoolError):
+    """Raised when a worker process dies while running a job."""
+
+
+# --- Worker Process ---
+
+def _current_rss_mb():
+    """Returns the resident set size of the current process in megabytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # Non-Linux fallback: peak RSS is the closest value available
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _worker_main(conn, max_jobs, max_rss_mb):
+    """
+    Worker loop: receives (job_id, func, args) tuples, runs func(*args) and sends back
+    (job_id, ok, result_or_exception, retiring). A None job asks the worker to exit.
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    jobs_done = 0
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        job_id, func, args = job
+        try:
+            ok, payload = True, func(*args)
+        except Exception as e:
+            ok, payload = False, e
+
+        jobs_done += 1
+        retiring = jobs_done >= max_jobs or _current_rss_mb() > max_rss_mb
+
+        try:
+            conn.send((job_id, ok, payload, retiring))
+        except Exception as e:
+            # The exception (or result) could not be pickled; report it as text instead
+            conn.send((job_id, False, RuntimeError(f"{type(payload).__name__}: {payload} ({e})"), retiring))
+
+        if retiring:
+            break
+
+    conn.close()
+
+
+# --- Pool ---
+
+class _Worker:
+    """Parent-side handle for one worker process and the job it is running."""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.job_id = None
+        self.future = None
+        self.deadline = None
+        self.started_at = None
+        self.lane = None
+
+    @property
+    def busy(self):
+        return self.future is not None
+
+
+class AnalyzerPool:
+    """
+    Pool of long-lived worker processes that import the analyzer modules once and
+    run jobs sent to them over a pipe.
+
+    Workers are started from a forkserver that has already imported the preload
+    modules, so replacing a worker costs a fork rather than a fresh interpreter.
+    Each job keeps a hard deadline: a worker that overruns it is killed and replaced.
+    Workers also retire themselves after max_jobs_per_worker jobs or once their RSS
+    passes max_rss_mb, and are replaced transparently.
+
+    Queued jobs wait in priority lanes served by weighted fair scheduling, and
+    reserved_workers workers are kept free for reserved_lane, so latency-sensitive
+    jobs are not stuck behind a backlog of heavy ones.
+    """
+
+    def __init__(self, preload=("analyzers",), size=POOL_SIZE, job_timeout=JOB_TIMEOUT_SECONDS,
+                 max_jobs_per_worker=MAX_JOBS_PER_WORKER, max_rss_mb=MAX_WORKER_RSS_MB,
+                 lane_weights=LANE_WEIGHTS, reserved_lane=RESERVED_LANE, reserved_workers=RESERVED_WORKERS):
+        """
+        Args:
+            preload (tuple): Modules imported once by the forkserver before workers are forked.
+            size (int): Number of worker processes.
+            job_timeout (float): Default per-job deadline in seconds.
+            max_jobs_per_worker (int): Jobs after which a worker is recycled.
+            max_rss_mb (float): RSS ceiling after which a worker is recycled.
+            lane_weights (dict): Lane name -> scheduling weight.
+            reserved_lane (str): Lane allowed to use the reserved workers.
+            reserved_workers (int): Workers other lanes may not occupy (at most size - 1).
+        """
+        self.preload = list(preload)
+        self.size = max(1, size)
+        self.job_timeout = job_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.lane_weights = dict(lane_weights)
+        self.reserved_lane = reserved_lane if reserved_lane in self.lane_weights else None
+        self.reserved_workers = max(0, min(reserved_workers, self.size - 1)) if self.reserved_lane else 0
+
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._ctx = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            self._ctx.set_forkserver_preload(self.preload)
+
+        self._workers = []
+        self._pending = {lane: deque() for lane in self.lane_weights}
+        self._lane_credit = {lane: 0 for lane in self.lane_weights}
+        self._lane_stats = {lane: {"dispatched": 0, "total_wait": 0.0, "max_wait": 0.0} for lane in self.lane_weights}
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        self._wake_r, self._wake_w = multiprocessing.Pipe(duplex=False)
+        self._wake_pending = False
+        self._closed = False
+        self._dispatcher = None
+
+        self._stats = {
+            "completed": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "crashes": 0,
+            "recycled": 0,
+        }
+
+    # --- Public API ---
+
+    def start(self):
+        """Starts the worker processes and the dispatcher thread."""
+        if self._dispatcher is not None:
+            return
+        logger.info(f"Starting analyzer pool with {self.size} workers")
+        for _ in range(self.size):
+            self._workers.append(self._spawn_worker())
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="analyzer-pool-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, func, *args, timeout=None, lane=DEFAULT_LANE):
+        """
+        Queues func(*args) for execution in a worker.
+
+        Args:
+            func (callable): Module-level function (pickled by reference) to run.
+            *args: Positional arguments passed to func in the worker.
+            timeout (float, optional): Per-job deadline; defaults to job_timeout.
+            lane (str): Priority lane to queue the job in.
+
+        Returns:
+            concurrent.futures.Future: Resolves to func's return value, or raises
+            func's exception, WorkerTimeoutError or WorkerCrashedError.
+        """
+        if lane not in self._pending:
+            raise ValueError(f"Unknown analyzer pool lane: {lane}")
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Analyzer pool is shut down")
+            self._pending[lane].append((next(self._job_ids), func, args, timeout or self.job_timeout, future, time.monotonic()))
+            self._wake()
+        return future
+
+    def run(self, func, *args, timeout=None, lane=DEFAULT_LANE):
+        """Runs func(*args) in a worker and blocks until the result is available."""
+        return self.submit(func, *args, timeout=timeout, lane=lane).result()
+
+    async def run_async(self, func, *args, timeout=None, lane=DEFAULT_LANE):
+        """Awaitable variant of run(); cancelling the awaiting task drops a still-queued job."""
+        return await asyncio.wrap_future(self.submit(func, *args, timeout=timeout, lane=lane))
+
+    def queue_depth(self, lane=None):
+        """Number of jobs waiting for a free worker, in one lane or in all of them."""
+        if lane is not None:
+            return len(self._pending[lane])
+        return sum(len(queue) for queue in self._pending.values())
+
+    def stats(self):
+        """Returns a snapshot of pool counters, with queue depth and wait times per lane."""
+        with self._lock:
+            lanes = {}
+            for lane, queue in self._pending.items():
+                lane_stats = self._lane_stats[lane]
+                dispatched = lane_stats["dispatched"]
+                lanes[lane] = {
+                    "weight": self.lane_weights[lane],
+                    "pending": len(queue),
+                    "busy": sum(1 for worker in self._workers if worker.busy and worker.lane == lane),
+                    "dispatched": dispatched,
+                    "avg_wait_ms": round(lane_stats["total_wait"] / dispatched * 1000, 1) if dispatched else 0.0,
+                    "max_wait_ms": round(lane_stats["max_wait"] * 1000, 1),
+                    "oldest_wait_ms": round((time.monotonic() - queue[0][5]) * 1000, 1) if queue else 0.0,
+                }
+        return {
+            "size": self.size,
+            "busy": sum(1 for worker in self._workers if worker.busy),
+            "pending": sum(lane["pending"] for lane in lanes.values()),
+            "reserved_workers": {self.reserved_lane: self.reserved_workers} if self.reserved_lane else {},
+            "lanes": lanes,
+            **self._stats,
+        }
+
+    def shutdown(self, wait_seconds=5):
+        """Stops the dispatcher, fails queued jobs and terminates all workers."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake()
+        if self._dispatcher is not None:
+            self._dispatcher.join(wait_seconds)
+        logger.info("Analyzer pool shut down")
+
+    # --- Internals ---
+
+    def _wake(self):
+        """Wakes the dispatcher thread. Must be called with self._lock held."""
+        if not self._wake_pending:
+            self._wake_pending = True
+            self._wake_w.send_bytes(b"\0")
+
+    def _spawn_worker(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.max_jobs_per_worker, self.max_rss_mb),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        logger.info(f"Started analyzer worker pid={process.pid}")
+        return _Worker(process, parent_conn)
+
+    def _replace_worker(self, worker, kill=False):
+        if kill:
+            worker.process.kill()
+        worker.process.join(1)
+        worker.conn.close()
+        index = self._workers.index(worker)
+        if self._closed:
+            self._workers.pop(index)
+        else:
+            self._workers[index] = self._spawn_worker()
+
+    def _finish_job(self, worker):
+        future = worker.future
+        worker.job_id = worker.future = worker.deadline = worker.started_at = worker.lane = None
+        return future
+
+    def _select_lane(self, lanes):
+        """Smooth weighted round-robin over the given non-empty lanes. Must be called with self._lock held."""
+        total = 0
+        selected = None
+        for lane in lanes:
+            self._lane_credit[lane] += self.lane_weights[lane]
+            total += self.lane_weights[lane]
+            if selected is None or self._lane_credit[lane] > self._lane_credit[selected]:
+                selected = lane
+        self._lane_credit[selected] -= total
+        return selected
+
+    def _next_job(self):
+        """Pops the next job to dispatch, or returns None if no job may run now."""
+        # Workers beyond this many busy ones are kept for the reserved lane
+        shared_limit = self.size - self.reserved_workers
+        shared_busy = sum(1 for worker in self._workers if worker.busy and worker.lane != self.reserved_lane)
+
+        with self._lock:
+            while True:
+                lanes = [lane for lane, queue in self._pending.items() if queue]
+                if shared_busy >= shared_limit:
+                    lanes = [lane for lane in lanes if lane == self.reserved_lane]
+                if not lanes:
+                    return None
+                lane = self._select_lane(lanes)
+                job_id, func, args, timeout, future, enqueued_at = self._pending[lane].popleft()
+                # Skip jobs whose caller already gave up
+                if future.set_running_or_notify_cancel():
+                    wait_seconds = time.monotonic() - enqueued_at
+                    lane_stats = self._lane_stats[lane]
+                    lane_stats["dispatched"] += 1
+                    lane_stats["total_wait"] += wait_seconds
+                    lane_stats["max_wait"] = max(lane_stats["max_wait"], wait_seconds)
+                    return lane, job_id, func, args, timeout, future
+
+    def _assign_pending(self):
+        for worker in self._workers:
+            if worker.busy:
+                continue
+            job = self._next_job()
+            if job is None:
+                return
+            lane, job_id, func, args, timeout, future = job
+            try:
+                worker.conn.send((job_id, func, args))
+            except Exception as e:
+                future.set_exception(WorkerCrashedError(f"Could not send job to worker: {e}"))
+                self._stats["crashes"] += 1
+                self._replace_worker(worker, kill=True)
+                continue
+            worker.job_id, worker.future, worker.lane = job_id, future, lane
+            worker.started_at = time.monotonic()
+            worker.deadline = worker.started_at + timeout
+
+    def _handle_message(self, worker):
+        try:
+            job_id, ok, payload, retiring = worker.conn.recv()
+        except (EOFError, OSError):
+            # Worker died; fail whatever it was running and replace it
+            logger.error(f"Analyzer worker pid={worker.process.pid} exited unexpectedly")
+            self._stats["crashes"] += 1
+            if worker.busy:
+                self._finish_job(worker).set_exception(
+                    WorkerCrashedError(f"Analyzer worker exited unexpectedly (exit code {worker.process.exitcode})"))
+            self._replace_worker(worker)
+            return
+
+        future = self._finish_job(worker)
+        if ok:
+            self._stats["completed"] += 1
+            future.set_result(payload)
+        else:
+            self._stats["failed"] += 1
+            future.set_exception(payload)
+
+        if retiring:
+            logger.info(f"Recycling analyzer worker pid={worker.process.pid}")
+            self._stats["recycled"] += 1
+            self._replace_worker(worker)
+
+    def _expire_jobs(self):
+        now = time.monotonic()
+        for worker in list(self._workers):
+            if worker.busy and now >= worker.deadline:
+                elapsed = now - worker.started_at
+                logger.error(f"Analyzer job {worker.job_id} exceeded its deadline after {elapsed:.1f}s; killing worker pid={worker.process.pid}")
+                self._stats["timeouts"] += 1
+                self._finish_job(worker).set_exception(
+                    WorkerTimeoutError(f"Analysis timed out after {elapsed:.1f} seconds"))
+                self._replace_worker(worker, kill=True)
+
+    def _dispatch_loop(self):
+        try:
+            while not self._closed:
+                self._assign_pending()
+
+                deadlines = [worker.deadline for worker in self._workers if worker.busy]
+                wait_timeout = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+
+                ready = wait([self._wake_r] + [worker.conn for worker in self._workers], wait_timeout)
+                for conn in ready:
+                    if conn is self._wake_r:
+                        with self._lock:
+                            while self._wake_r.poll():
+                                self._wake_r.recv_bytes()
+                            self._wake_pending = False
+                        continue
+                    worker = next((w for w in self._workers if w.conn is conn), None)
+                    if worker is not None:
+                        self._handle_message(worker)
+
+                self._expire_jobs()
+        except Exception as e:
+            logger.critical(f"Analyzer pool dispatcher failed: {e}", exc_info=True)
+        finally:
+            self._stop_workers()
+
+    def _stop_workers(self):
+        with self._lock:
+            self._closed = True
+            pending = [job for queue in self._pending.values() for job in queue]
+            for queue in self._pending.values():
+                queue.clear()
+        for _, _, _, _, future, _ in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(RuntimeError("Analyzer pool is shut down"))
+        for worker in self._workers:
+            if worker.busy:
+                self._finish_job(worker).set_exception(RuntimeError("Analyzer pool is shut down"))
+            try:
+                worker.conn.send(None)
+            except Exception:
+                pass
+        for worker in self._workers:
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.process.kill()
+            worker.conn.close()
+        self._workers = []
@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.workqueue")
+
+# --- Configuration ---
+# Identifies this API instance in leases and node stats
+WORKQUEUE_NODE_ID = os.getenv("WORKQUEUE_NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Concurrent items processed by this node (0 disables the worker)
+WORKQUEUE_WORKERS = int(os.getenv("WORKQUEUE_WORKERS", 2))
+# How long a claimed item stays leased without a heartbeat (seconds)
+WORKQUEUE_LEASE_SECONDS = float(os.getenv("WORKQUEUE_LEASE_SECONDS", 30))
+# Attempts before an item is marked failed instead of being reclaimed
+WORKQUEUE_MAX_ATTEMPTS = int(os.getenv("WORKQUEUE_MAX_ATTEMPTS", 3))
+# How often idle workers look for claimable items (seconds)
+WORKQUEUE_POLL_INTERVAL = float(os.getenv("WORKQUEUE_POLL_INTERVAL", 2))
+
+# Item states
+ITEM_QUEUED = "queued"
+ITEM_LEASED = "leased"
+ITEM_DONE = "done"
+ITEM_FAILED = "failed"
+
+
+class WorkQueue:
+    """
+    Durable work queue on a MongoDB collection shared by every API instance.
+
+    Items are claimed with an atomic find_one_and_update that sets a lease owner and
+    expiry. The owner extends the lease with heartbeats while it works; an item whose
+    lease expires (its node died or stalled) becomes claimable again, until it has
+    used up max_attempts and is marked failed.
+
+    The collections are passed in, so the queue runs the same against a real mongod
+    or an in-memory stand-in with the pymongo collection API. Its indexes are declared
+    in storage.INDEXES and built with the service's other indexes. The job API
+    (jobs.JobRunner) keeps its jobs in a WorkQueue of its own.
+    """
+
+    def __init__(self, collection, nodes_collection=None, node_id=WORKQUEUE_NODE_ID,
+                 lease_seconds=WORKQUEUE_LEASE_SECONDS, max_attempts=WORKQUEUE_MAX_ATTEMPTS):
+        """
+        Args:
+            collection: Collection holding the queue items.
+            nodes_collection: Collection holding one stats document per node, or None
+                to not publish node stats.
+            node_id (str): Lease owner name for this instance.
+            lease_seconds (float): Lease duration renewed by each heartbeat.
+            max_attempts (int): Claims allowed per item.
+        """
+        self.collection = collection
+        self.nodes_collection = nodes_collection
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, items):
+        """
+        Adds (script_name, object_id) pairs to the queue.
+
+        Returns:
+            list: The inserted item ids as strings.
+        """
+        now = datetime.utcnow()
+        docs = [
+            {
+                "script_name": script_name,
+                "object_id": object_id,
+                "status": ITEM_QUEUED,
+                "attempts": 0,
+                "createdAt": now,
+                "updatedAt": now,
+            }
+            for script_name, object_id in items
+        ]
+        if not docs:
+            return []
+        result = self.collection.insert_many(docs, ordered=False)
+        logger.info(f"Enqueued {len(result.inserted_ids)} work items")
+        return [str(item_id) for item_id in result.inserted_ids]
+
+    def get(self, item_id):
+        """Returns the item document, or None if item_id is invalid or unknown."""
+        if not ObjectId.is_valid(item_id):
+            return None
+        return self.collection.find_one({"_id": ObjectId(item_id)})
+
+    def claim(self):
+        """
+        Leases the oldest claimable item to this node.
+
+        Returns:
+            dict or None: The claimed item, or None if nothing is claimable.
+        """
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {
+                "$or": [
+                    {"status": ITEM_QUEUED},
+                    {"status": ITEM_LEASED, "leaseExpiresAt": {"$lt": now}},
+                ],
+                "attempts": {"$lt": self.max_attempts},
+            },
+            {
+                "$set": {
+                    "status": ITEM_LEASED,
+                    "leaseOwner": self.node_id,
+                    "leaseExpiresAt": now + timedelta(seconds=self.lease_seconds),
+                    "startedAt": now,
+                    "updatedAt": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("createdAt", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, item_id):
+        """
+        Extends this node's lease on an item.
+
+        Returns:
+            bool: False if the lease was lost (expired and claimed by another node).
+        """
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            {"_id": item_id, "status": ITEM_LEASED, "leaseOwner": self.node_id},
+            {"$set": {"leaseExpiresAt": now + timedelta(seconds=self.lease_seconds), "updatedAt": now}},
+        )
+        return result.matched_count == 1
+
+    def complete(self, item_id, ok, error=None, result=None):
+        """
+        Marks a leased item done or failed, with its error message or result if given.
+
+        Returns:
+            bool: False if this node no longer held the lease.
+        """
+        now = datetime.utcnow()
+        update = {"status": ITEM_DONE if ok else ITEM_FAILED, "finishedBy": self.node_id, "finishedAt": now, "updatedAt": now}
+        if error is not None:
+            update["error"] = error
+        if result is not None:
+            update["result"] = result
+        result = self.collection.update_one(
+            {"_id": item_id, "status": ITEM_LEASED, "leaseOwner": self.node_id},
+            {"$set": update, "$unset": {"leaseExpiresAt": ""}},
+        )
+        return result.matched_count == 1
+
+    def reclaim_expired(self):
+        """
+        Requeues items whose lease expired and fails those out of attempts.
+
+        Returns:
+            tuple: (requeued, failed) counts.
+        """
+        now = datetime.utcnow()
+        expired = {"status": ITEM_LEASED, "leaseExpiresAt": {"$lt": now}}
+        failed = self.collection.update_many(
+            {**expired, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": ITEM_FAILED, "error": "Lease expired too many times", "finishedAt": now, "updatedAt": now},
+             "$unset": {"leaseOwner": "", "leaseExpiresAt": ""}},
+        ).modified_count
+        requeued = self.collection.update_many(
+            expired,
+            {"$set": {"status": ITEM_QUEUED, "updatedAt": now}, "$unset": {"leaseOwner": "", "leaseExpiresAt": ""}},
+        ).modified_count
+        if requeued or failed:
+            logger.warning(f"Reclaimed {requeued} expired leases ({failed} items out of attempts)")
+        return requeued, failed
+
+    def report_node_stats(self, stats):
+        """Upserts this node's throughput counters into the nodes collection, if there is one."""
+        if self.nodes_collection is None:
+            return
+        self.nodes_collection.update_one(
+            {"_id": self.node_id},
+            {"$set": {**stats, "lastSeen": datetime.utcnow()}},
+            upsert=True,
+        )
+
+    def stats(self):
+        """Returns item counts per status and the stats reported by every node."""
+        counts = {ITEM_QUEUED: 0, ITEM_LEASED: 0, ITEM_DONE: 0, ITEM_FAILED: 0}
+        for row in self.collection.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        nodes = {}
+        for node in self.nodes_collection.find() if self.nodes_collection is not None else []:
+            node_id = node.pop("_id")
+            node["lastSeen"] = node["lastSeen"].isoformat()
+            nodes[node_id] = node
+        return {"items": counts, "nodes": nodes}
+
+
+class WorkQueueWorker:
+    """
+    Processes WorkQueue items on this node with a fixed number of concurrent loops,
+    heartbeating each lease while its analysis runs.
+    """
+
+    def __init__(self, queue, execute, run_blocking, concurrency=WORKQUEUE_WORKERS,
+                 poll_interval=WORKQUEUE_POLL_INTERVAL, store_results=False):
+        """
+        Args:
+            queue (WorkQueue): The shared queue.
+            execute (callable): Coroutine function (script_name, object_id) -> (ok, payload).
+            run_blocking (callable): Coroutine function that runs a blocking call off the event loop.
+            concurrency (int): Number of concurrent worker loops.
+            poll_interval (float): Idle wait between claim attempts (seconds).
+            store_results (bool): Record each item's analyzer response on the item.
+        """
+        self.queue = queue
+        self.execute = execute
+        self.run_blocking = run_blocking
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.store_results = store_results
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+
+        self.started_at = time.monotonic()
+        self.processed = 0
+        self.failed = 0
+        self.lost_leases = 0
+        self.busy_seconds = 0.0
+
+    async def start(self):
+        if self.concurrency <= 0:
+            return
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.ensure_future(self._worker_loop(n)) for n in range(self.concurrency)]
+        self._tasks.append(asyncio.ensure_future(self._maintenance_loop()))
+        logger.info(f"Work queue node {self.queue.node_id} started with {self.concurrency} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Lets idle worker loops claim items enqueued by this process without waiting for the next poll."""
+        self._wakeup.set()
+
+    def stats(self):
+        """Throughput counters for this node."""
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "workers": self.concurrency,
+            "processed": self.processed,
+            "failed": self.failed,
+            "lost_leases": self.lost_leases,
+            "items_per_second": round(self.processed / elapsed, 3) if elapsed > 0 else 0.0,
+            "utilization": round(self.busy_seconds / (elapsed * self.concurrency), 3) if elapsed > 0 and self.concurrency else 0.0,
+        }
+
+    async def _worker_loop(self, number):
+        while True:
+            try:
+                self._wakeup.clear()
+                item = await self.run_blocking(self.queue.claim)
+                if item is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                # Other idle loops may find more claimable items
+                self._wakeup.set()
+                await self._process(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Work queue worker {number} error: {str(e)}", exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _process(self, item):
+        started_at = time.monotonic()
+        heartbeat = asyncio.ensure_future(self._heartbeat_loop(item["_id"]))
+        try:
+            ok, payload = await self.execute(item["script_name"], item["object_id"])
+        except Exception as e:
+            ok, payload = False, str(e)
+        finally:
+            heartbeat.cancel()
+
+        held = await self.run_blocking(
+            self.queue.complete, item["_id"], ok, None if ok else payload, payload if ok and self.store_results else None)
+        if not held:
+            self.lost_leases += 1
+            logger.warning(f"Lease on work item {item['_id']} was lost before completion")
+        self.processed += 1
+        if not ok:
+            self.failed += 1
+        self.busy_seconds += time.monotonic() - started_at
+
+    async def _heartbeat_loop(self, item_id):
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds / 3)
+            try:
+                if not await self.run_blocking(self.queue.heartbeat, item_id):
+                    logger.warning(f"Heartbeat for work item {item_id} found the lease gone")
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat for work item {item_id} failed: {str(e)}")
+
+    async def _maintenance_loop(self):
+        # Reclaim expired leases and publish this node's stats once per lease period
+        while True:
+            await asyncio.sleep(self.queue.lease_seconds)
+            try:
+                await self.run_blocking(self.queue.reclaim_expired)
+                await self.run_blocking(self.queue.report_node_stats, self.stats())
+            except Exception as e:
+                logger.error(f"Work queue maintenance failed: {str(e)}")
@@ -0,0 +1,168 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+# Get logger from main application or create a new one if imported directly
+logger = logging.getLogger("py-api.writebehind")
+
+# --- Configuration ---
+# Responses held in memory before writers are made to wait (backpressure)
+RESPONSE_BUFFER_MAX_SIZE = int(os.getenv("RESPONSE_BUFFER_MAX_SIZE", 5000))
+# Responses written per insert_many; a full batch is flushed immediately
+RESPONSE_FLUSH_SIZE = int(os.getenv("RESPONSE_FLUSH_SIZE", 200))
+# Longest time a response waits in the buffer before it is flushed (seconds)
+RESPONSE_FLUSH_INTERVAL = float(os.getenv("RESPONSE_FLUSH_INTERVAL", 0.5))
+
+
+class WriteBehindBuffer:
+    """
+    Bounded in-memory buffer that writes documents in batches off the request path.
+
+    put() only appends to the buffer; a background task writes a batch once
+    flush_size documents are waiting or the oldest has waited flush_interval
+    seconds. When max_size documents are buffered, put() waits until a flush
+    makes room, so a slow database slows producers down instead of growing the
+    buffer without bound. stop() writes everything still buffered.
+
+    Buffered documents are lost if the process dies before they are flushed;
+    callers that must not lose a write (e.g. before saving a checkpoint) await
+    flush().
+    """
+
+    def __init__(self, write, run_blocking, max_size=RESPONSE_BUFFER_MAX_SIZE,
+                 flush_size=RESPONSE_FLUSH_SIZE, flush_interval=RESPONSE_FLUSH_INTERVAL):
+        """
+        Args:
+            write (callable): Blocking function (documents) -> number of documents written.
+            run_blocking (callable): Coroutine function that runs a blocking call off the event loop.
+            max_size (int): Documents buffered before put() waits.
+            flush_size (int): Documents per write.
+            flush_interval (float): Maximum age of a buffered document in seconds.
+        """
+        self.write = write
+        self.run_blocking = run_blocking
+        self.flush_size = max(1, flush_size)
+        self.max_size = max(self.flush_size, max_size)
+        self.flush_interval = flush_interval
+
+        # (enqueued_at, document) pairs, oldest first
+        self._buffer = collections.deque()
+        self._not_empty = asyncio.Event()
+        self._full = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._task = None
+
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.backpressure_waits = 0
+        self.max_batch_size = 0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._closing = False
+            self._task = asyncio.ensure_future(self._flush_loop())
+            logger.info(f"Started write-behind buffer (flush size {self.flush_size}, interval {self.flush_interval}s)")
+
+    async def stop(self):
+        """Flushes every buffered document and stops the background task."""
+        if self._task is not None:
+            self._closing = True
+            self._not_empty.set()
+            self._full.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Anything put() after the loop exited
+        await self.flush()
+
+    async def put(self, document):
+        """Buffers a document for writing, waiting for room if the buffer is full."""
+        if len(self._buffer) >= self.max_size:
+            self.backpressure_waits += 1
+            while len(self._buffer) >= self.max_size:
+                self._has_space.clear()
+                await self._has_space.wait()
+
+        self._buffer.append((asyncio.get_running_loop().time(), document))
+        self._not_empty.set()
+        if len(self._buffer) >= self.flush_size:
+            self._full.set()
+
+    async def flush(self):
+        """Writes everything buffered so far, including a batch the background task is writing."""
+        async with self._flush_lock:
+            while self._buffer:
+                await self._write_batch()
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "max_size": self.max_size,
+            "flushes": self.flushes,
+            "written": self.written,
+            "failed": self.failed,
+            "backpressure_waits": self.backpressure_waits,
+            "avg_batch_size": round((self.written + self.failed) / self.flushes, 1) if self.flushes else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "avg_flush_ms": round(self.total_flush_seconds * 1000 / self.flushes, 1) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 1),
+        }
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if not self._buffer:
+                    if self._closing:
+                        return
+                    self._not_empty.clear()
+                    await self._not_empty.wait()
+                    continue
+
+                # Wait for a full batch, but no longer than the oldest document may age
+                remaining = self._buffer[0][0] + self.flush_interval - loop.time()
+                if remaining > 0 and len(self._buffer) < self.flush_size and not self._closing:
+                    self._full.clear()
+                    try:
+                        await asyncio.wait_for(self._full.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                async with self._flush_lock:
+                    await self._write_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Write-behind flush loop error: {str(e)}", exc_info=True)
+                await asyncio.sleep(self.flush_interval)
+
+    async def _write_batch(self):
+        # Caller holds _flush_lock
+        batch = [self._buffer.popleft()[1] for _ in range(min(self.flush_size, len(self._buffer)))]
+        if not batch:
+            return
+        self._has_space.set()
+        if len(self._buffer) < self.flush_size:
+            self._full.clear()
+
+        started_at = time.monotonic()
+        try:
+            written = await self.run_blocking(self.write, batch)
+        except Exception as e:
+            logger.error(f"Write-behind flush of {len(batch)} documents failed: {str(e)}")
+            written = 0
+        elapsed = time.monotonic() - started_at
+
+        self.flushes += 1
+        self.written += written
+        self.failed += len(batch) - written
+        self.max_batch_size = max(self.max_batch_size, len(batch))
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)